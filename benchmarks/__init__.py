@@ -0,0 +1,4 @@
+"""
+    Benchmarks for redminebot, run from the repository root with
+    `python -m benchmarks.<name>`
+"""
@@ -0,0 +1,177 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from benchmarks import fakes
+
+"""
+    Command benchmark
+
+    Runs every command verb the dispatcher knows through handle_command
+    against the in-process fake Redmine and Slack, and reports the wall
+    time and the number of calls made to each backend. Results can be
+    saved as a baseline and later runs compared against it.
+
+    python -m benchmarks.commands --save benchmarks/baseline.json
+    python -m benchmarks.commands --compare benchmarks/baseline.json
+"""
+# Benchmarked user and channel; user1 authors the first Top 5 issues
+BENCH_LOGIN = "user1"
+BENCH_USER = "U1"
+BENCH_CHANNEL = "C1"
+
+# One command per dispatcher verb, run in this order; the write commands
+# change the fake data set so later runs see their effects
+VERBS = [
+    ("help", "help"),
+    ("link", "3"),
+    ("sum", "sum 3"),
+    ("list", "list"),
+    ("listfor", "listfor user2"),
+    ("listall", "listall"),
+    ("more", "more"),
+    ("listun", "listun"),
+    ("scrum", "scrum"),
+    ("scrumfor", "scrumfor user2"),
+    ("eod", "eod"),
+    ("eodfor", "eodfor user2"),
+    ("eow", "eow"),
+    ("eowfor", "eowfor user2"),
+    ("t5", "t5"),
+    ("t5for", "t5for user2"),
+    ("issue", "issue benchmark issue $2h"),
+    ("issueto", "issueto user2 benchmark issue"),
+    ("issuep", "issuep project1 benchmark issue"),
+    ("issuepto", "issuepto project1 user2 benchmark issue"),
+    ("issuepv", "issuepv project1 v1.0 benchmark issue"),
+    ("issuepvto", "issuepvto project1 v2.0 user2 benchmark issue"),
+    ("update", "update 3 benchmark comment !1h %50"),
+    ("assign", "assign 5 user2 benchmark"),
+    ("status", "status 6 in benchmark"),
+    ("rank", "rank 7 2 benchmark"),
+    ("close", "close 4 benchmark"),
+    ("reject", "reject 8 benchmark"),
+    ("t5add", "t5add 2 benchmark top 5"),
+    ("t5rank", "t5rank 1 3 benchmark"),
+    ("wadd", "wadd 3 user4"),
+    ("wdel", "wdel 3 user4")
+]
+
+def setup(args):
+    """
+        Start the fakes and import the bot pointed at them, loading the
+        catalogs the bot loads at startup so steady state is measured
+    """
+    data = fakes.Dataset(users=args.users, projects=args.projects, \
+                         issues_per_user=args.issues_per_user, \
+                         entries_per_issue=args.entries_per_issue)
+    redmine = fakes.FakeRedmine(data, latency=args.redmine_latency / 1000.0).start()
+    slack = fakes.FakeSlack(data, latency=args.slack_latency / 1000.0)
+    os.environ.update(fakes.BOT_ENV)
+    os.environ['REDMINE_HOST'] = redmine.url
+    import redminebot
+    redminebot.sc = slack
+    redminebot.SLACK_DIRECTORY.load(slack)
+    redminebot.CATALOG.load()
+    if args.mirror:
+        redminebot.MIRROR = redminebot.IssueMirror(":memory:", redminebot.rc)
+        redminebot.MIRROR.sync(full=True)
+    return (redminebot, redmine, slack)
+
+def run(bot, redmine, slack, verbs, repeat):
+    results = {}
+    for i in range(repeat):
+        for (verb, command) in verbs:
+            redmine.reset_counts()
+            slack.reset_counts()
+            start = time.time()
+            bot.handle_command(command, BENCH_CHANNEL, BENCH_USER, BENCH_LOGIN)
+            elapsed = (time.time() - start) * 1000
+            result = results.setdefault(verb, {'command': command, 'runs': []})
+            result['runs'].append(elapsed)
+            # calls of the last run, once caches are warm
+            result['redmine_calls'] = redmine.total_calls()
+            result['slack_calls'] = slack.total_calls()
+            result['redmine_endpoints'] = dict(redmine.calls)
+            if bot.MIRROR is not None and not bot.MIRROR.ready():
+                # what the sync thread does after a write
+                bot.MIRROR.sync()
+    for result in results.values():
+        runs = sorted(result.pop('runs'))
+        result['wall_ms'] = round(runs[len(runs) // 2], 2)
+    return results
+
+def compare(results, baseline, threshold):
+    """
+        Regressions against a saved baseline: any extra backend call, or
+        median wall time more than `threshold` percent slower
+    """
+    regressions = []
+    for (verb, result) in sorted(results.items()):
+        base = baseline.get(verb)
+        if base is None:
+            continue
+        for key in ('redmine_calls', 'slack_calls'):
+            if result[key] > base[key]:
+                regressions.append(verb+": "+key+" "+str(base[key])+" -> "+str(result[key]))
+        if base['wall_ms'] > 0 and \
+          (result['wall_ms'] - base['wall_ms']) * 100.0 / base['wall_ms'] > threshold:
+            regressions.append(verb+": wall_ms "+str(base['wall_ms'])+" -> "+str(result['wall_ms']))
+    return regressions
+
+def report(results, baseline=None):
+    sys.stdout.write("%-10s %10s %8s %8s  %s\n" % ("verb", "wall ms", "redmine", "slack", "baseline"))
+    for (verb, command) in VERBS:
+        if verb not in results:
+            continue
+        result = results[verb]
+        base = ""
+        if baseline and verb in baseline:
+            base = "%.2f ms, %d/%d calls" % (baseline[verb]['wall_ms'], \
+                   baseline[verb]['redmine_calls'], baseline[verb]['slack_calls'])
+        sys.stdout.write("%-10s %10.2f %8d %8d  %s\n" % (verb, result['wall_ms'], \
+                         result['redmine_calls'], result['slack_calls'], base))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bot commands against fake backends")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--projects', type=int, default=5)
+    parser.add_argument('--issues-per-user', type=int, default=20)
+    parser.add_argument('--entries-per-issue', type=int, default=2)
+    parser.add_argument('--redmine-latency', type=float, default=0.0, help="ms added to each Redmine call")
+    parser.add_argument('--slack-latency', type=float, default=0.0, help="ms added to each Slack call")
+    parser.add_argument('--repeat', type=int, default=3, help="runs of each verb; the median is reported")
+    parser.add_argument('--verbs', help="comma separated verbs to run instead of all")
+    parser.add_argument('--mirror', action='store_true', help="serve reads from an in-memory mirror")
+    parser.add_argument('--save', help="write results to this baseline file")
+    parser.add_argument('--compare', help="compare results with this baseline file")
+    parser.add_argument('--threshold', type=float, default=25.0, help="allowed wall time regression in percent")
+    args = parser.parse_args()
+
+    verbs = VERBS
+    if args.verbs:
+        wanted = args.verbs.split(',')
+        verbs = [(verb, command) for (verb, command) in VERBS if verb in wanted]
+    (bot, redmine, slack) = setup(args)
+    results = run(bot, redmine, slack, verbs, args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    report(results, baseline)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2, sort_keys=True)
+    redmine.stop()
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            sys.stdout.write("REGRESSION "+regression+"\n")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,530 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from datetime import timedelta
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+"""
+    In-process stand-ins for the Redmine REST API and the Slack Web/RTM API
+"""
+STATUSES = [
+    (1, "New", False),
+    (2, "In Progress", False),
+    (3, "Resolved", False),
+    (4, "Feedback", False),
+    (5, "Closed", True),
+    (6, "Rejected", True),
+    (7, "Hold", False)
+]
+PRIORITIES = [(1, "Low"), (2, "Normal"), (3, "High"), (4, "Urgent"), (5, "Immediate")]
+TRACKERS = [(1, "Bug"), (2, "Task")]
+ACTIVITIES = [(10, "Development")]
+WATCHED_QUERY_ID = 14
+
+# Environment the bot needs to talk to the fake Redmine instance
+BOT_ENV = {
+    'REDMINE_EXT_HOST': "http://redmine.example",
+    'REDMINE_VERSION': "3.3.1",
+    'REDMINE_TOKEN': "fake-token",
+    'REDMINE_NEW_ID': "1",
+    'REDMINE_INPROGRESS_ID': "2",
+    'REDMINE_RESOLVED_ID': "3",
+    'REDMINE_FEEDBACK_ID': "4",
+    'REDMINE_CLOSED_ID': "5",
+    'REDMINE_REJECTED_ID': "6",
+    'REDMINE_HOLD_ID': "7",
+    'REDMINE_ACTIVITY_ID': "10",
+    'REDMINE_PROJECT': "general",
+    'REDMINE_TOP5_PROJECT': "top5",
+    'REDMINE_TRACKER_ID': "2",
+    'REDMINE_WATCHED_QUERY_ID': str(WATCHED_QUERY_ID),
+    'BOT_ID': "UBOT",
+    'BOT_TOKEN': "xoxb-fake"
+}
+
+def redmine_time(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def ref(id, name):
+    return {'id': id, 'name': name}
+
+class Dataset(object):
+    """
+        Deterministic Redmine data set sized by number of users, projects,
+        issues per user and time entries per issue
+    """
+    def __init__(self, users=20, projects=5, issues_per_user=20, entries_per_issue=2,
+                 journals_per_issue=3, seed=1, now=None):
+        rnd = random.Random(seed)
+        now = (now or datetime.utcnow()).replace(microsecond=0)
+        self.lock = threading.Lock()
+        self.users = {}
+        for i in range(1, users + 1):
+            self.users[i] = {'id': i, 'login': "user"+str(i), 'firstname': "First"+str(i),
+                             'lastname': "Last"+str(i), 'mail': "user"+str(i)+"@example.com",
+                             'created_on': redmine_time(now - timedelta(days=400))}
+        self.projects = {}
+        self.versions = {}
+        identifiers = ['general', 'top5'] + ["project"+str(i) for i in range(1, projects + 1)]
+        for (n, identifier) in enumerate(identifiers):
+            pid = n + 1
+            self.projects[pid] = {'id': pid, 'name': identifier.capitalize(), 'identifier': identifier,
+                                  'description': "", 'status': 1,
+                                  'created_on': redmine_time(now - timedelta(days=500)),
+                                  'updated_on': redmine_time(now - timedelta(days=30))}
+            for v in ("1.0", "2.0"):
+                vid = len(self.versions) + 1
+                self.versions[vid] = {'id': vid, 'project': ref(pid, self.projects[pid]['name']),
+                                      'name': "v"+v, 'status': 'open'}
+        self.issues = {}
+        self.journals = defaultdict(list)
+        self.watchers = defaultdict(list)
+        self.time_entries = {}
+        user_ids = sorted(self.users)
+        for uid in user_ids:
+            for n in range(issues_per_user):
+                top5 = n < 5
+                project = self.projects[2] if top5 else self.projects[rnd.choice([1] + list(range(3, len(identifiers) + 1)))]
+                self.add_issue(rnd, now, project, uid, uid if top5 else rnd.choice(user_ids),
+                               6 - (n + 1) if top5 else rnd.choice(PRIORITIES)[0])
+        for issue in list(self.issues.values()):
+            for n in range(rnd.randint(0, journals_per_issue)):
+                self.journals[issue['id']].append(self.make_journal(rnd, now, issue))
+            self.watchers[issue['id']] = rnd.sample(user_ids, min(len(user_ids), rnd.randint(0, 3)))
+            for n in range(rnd.randint(0, entries_per_issue)):
+                user = rnd.choice(user_ids)
+                self.add_time_entry(issue['id'], user, rnd.choice([0.5, 1.0, 2.0]),
+                                    (now - timedelta(days=rnd.randint(0, 9))).date())
+
+    def add_issue(self, rnd, now, project, author, assigned, priority):
+        iid = len(self.issues) + 1
+        status = rnd.choice(STATUSES)
+        created = now - timedelta(days=rnd.randint(0, 60), hours=rnd.randint(0, 23))
+        updated = max(created, now - timedelta(days=rnd.randint(0, 10), hours=rnd.randint(0, 23)))
+        issue = {
+            'id': iid,
+            'project': ref(project['id'], project['name']),
+            'tracker': ref(*TRACKERS[1]),
+            'status': ref(status[0], status[1]),
+            'priority': ref(priority, dict(PRIORITIES)[priority]),
+            'author': self.user_ref(author),
+            'subject': "Issue number "+str(iid),
+            'description': "Description of issue "+str(iid),
+            'start_date': str(created.date()),
+            'done_ratio': rnd.choice([0, 10, 50, 90]),
+            'created_on': redmine_time(created),
+            'updated_on': redmine_time(updated)
+        }
+        if assigned:
+            issue['assigned_to'] = self.user_ref(assigned)
+        if rnd.random() < 0.5:
+            issue['estimated_hours'] = rnd.choice([1.0, 4.0, 8.0])
+        if rnd.random() < 0.3:
+            issue['due_date'] = str((created + timedelta(days=14)).date())
+        versions = [v for v in self.versions.values() if v['project']['id'] == project['id']]
+        if versions and rnd.random() < 0.3:
+            issue['fixed_version'] = ref(versions[0]['id'], versions[0]['name'])
+        self.issues[iid] = issue
+        return issue
+
+    def make_journal(self, rnd, now, issue):
+        details = []
+        choice = rnd.randint(0, 3)
+        if choice == 0:
+            details.append({'property': 'attr', 'name': 'status_id', 'old_value': "1", 'new_value': "2"})
+        elif choice == 1:
+            details.append({'property': 'attr', 'name': 'assigned_to_id',
+                            'old_value': str(rnd.choice(list(self.users))),
+                            'new_value': str(rnd.choice(list(self.users)))})
+        elif choice == 2:
+            details.append({'property': 'attr', 'name': 'done_ratio', 'old_value': "0", 'new_value': "50"})
+        return {'id': sum(len(j) for j in self.journals.values()) + 1,
+                'user': self.user_ref(rnd.choice(list(self.users))),
+                'notes': "Comment" if rnd.random() < 0.5 else "",
+                'created_on': issue['updated_on'],
+                'details': details}
+
+    def add_time_entry(self, issueid, userid, hours, spent_on):
+        teid = len(self.time_entries) + 1
+        issue = self.issues[issueid]
+        self.time_entries[teid] = {'id': teid, 'project': issue['project'], 'issue': {'id': issueid},
+                                   'user': self.user_ref(userid), 'activity': ref(*ACTIVITIES[0]),
+                                   'hours': hours, 'comments': "", 'spent_on': str(spent_on),
+                                   'created_on': redmine_time(datetime.utcnow()),
+                                   'updated_on': redmine_time(datetime.utcnow())}
+        return self.time_entries[teid]
+
+    def user_ref(self, userid):
+        user = self.users[userid]
+        return ref(userid, user['firstname']+" "+user['lastname'])
+
+    def user_by_login(self, login):
+        for user in self.users.values():
+            if user['login'] == login:
+                return user
+        return None
+
+    def project(self, key):
+        for project in self.projects.values():
+            if str(project['id']) == str(key) or project['identifier'] == key:
+                return project
+        return None
+
+class FakeRedmine(object):
+    """
+        Threaded HTTP server implementing the subset of the Redmine REST API
+        used by the bot, with per-endpoint call counts and injected latency
+    """
+    def __init__(self, dataset=None, latency=0.0):
+        self.data = dataset or Dataset()
+        self.latency = latency
+        self.calls = defaultdict(int)
+        self.durations = defaultdict(float)
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:"+str(self.server.server_port)
+
+    def start(self):
+        fake = self
+        class Handler(FakeRedmineHandler):
+            redmine = fake
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def reset_counts(self):
+        with self.lock:
+            self.calls.clear()
+            self.durations.clear()
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def record(self, endpoint, duration):
+        with self.lock:
+            self.calls[endpoint] += 1
+            self.durations[endpoint] += duration
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class FakeRedmineHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out as separate writes; without this the
+    # client's delayed ACK adds ~40ms to every keep-alive request
+    disable_nagle_algorithm = True
+    redmine = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        start = time.time()
+        url = urlparse(self.path)
+        params = dict((k, v[-1]) for (k, v) in parse_qs(url.query).items())
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+        endpoint = method+" "+re.sub(r'/\d+', '/:id', url.path)
+        if self.redmine.latency:
+            time.sleep(self.redmine.latency)
+        try:
+            with self.redmine.data.lock:
+                status, payload = route(self.redmine.data, method, url.path, params, body,
+                                        self.headers.get('X-Redmine-Switch-User'))
+        except Exception as e:
+            status, payload = 500, {'errors': [str(e)]}
+        out = json.dumps(payload).encode('utf-8') if payload is not None else b""
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+        self.redmine.record(endpoint, time.time() - start)
+
+def paginate(items, params, container):
+    limit = int(params.get('limit', 25))
+    offset = int(params.get('offset', 0))
+    return 200, {container: items[offset:offset + limit], 'total_count': len(items),
+                 'limit': limit, 'offset': offset}
+
+def route(data, method, path, params, body, switch_user):
+    m = re.match(r'^/(.*)\.json$', path)
+    if not m:
+        return 404, None
+    parts = m.group(1).split('/')
+    if method == 'GET':
+        if parts == ['users']:
+            name = params.get('name', '').lower()
+            users = [u for u in sorted(data.users.values(), key=lambda u: u['id'])
+                     if name in (u['login'].lower(), u['firstname'].lower(), u['lastname'].lower(),
+                                 (u['firstname']+" "+u['lastname']).lower())]
+            return paginate(users, params, 'users')
+        if parts[0] == 'users' and len(parts) == 2:
+            user = data.users.get(int(parts[1]))
+            return (200, {'user': user}) if user else (404, None)
+        if parts == ['issues']:
+            return paginate(filter_issues(data, params, switch_user), params, 'issues')
+        if parts[0] == 'issues' and len(parts) == 2:
+            issue = data.issues.get(int(parts[1]))
+            if not issue:
+                return 404, None
+            issue = dict(issue)
+            include = params.get('include', '').split(',')
+            if 'journals' in include:
+                issue['journals'] = data.journals[issue['id']]
+            if 'watchers' in include:
+                issue['watchers'] = [data.user_ref(u) for u in data.watchers[issue['id']]]
+            issue['spent_hours'] = sum(te['hours'] for te in data.time_entries.values()
+                                       if te['issue']['id'] == issue['id'])
+            return 200, {'issue': issue}
+        if parts == ['time_entries']:
+            if ',' in str(params.get('issue_id', '')):
+                # Redmine looks up one issue here; a list is not a filter
+                return 422, {'errors': ["issue_id takes a single issue"]}
+            return paginate(filter_time_entries(data, params), params, 'time_entries')
+        if parts == ['projects']:
+            return paginate(sorted(data.projects.values(), key=lambda p: p['id']), params, 'projects')
+        if parts[0] == 'projects' and len(parts) == 2:
+            project = data.project(parts[1])
+            return (200, {'project': project}) if project else (404, None)
+        if parts[0] == 'projects' and len(parts) == 3 and parts[2] == 'versions':
+            project = data.project(parts[1])
+            if not project:
+                return 404, None
+            versions = [v for v in sorted(data.versions.values(), key=lambda v: v['id'])
+                        if v['project']['id'] == project['id']]
+            return 200, {'versions': versions, 'total_count': len(versions)}
+        if parts == ['issue_statuses']:
+            return 200, {'issue_statuses': [{'id': i, 'name': n, 'is_closed': c} for (i, n, c) in STATUSES]}
+        if parts == ['trackers']:
+            return 200, {'trackers': [ref(i, n) for (i, n) in TRACKERS]}
+        if parts == ['enumerations', 'issue_priorities']:
+            return 200, {'issue_priorities': [dict(ref(i, n), is_default=(i == 2)) for (i, n) in PRIORITIES]}
+        if parts == ['enumerations', 'time_entry_activities']:
+            return 200, {'time_entry_activities': [dict(ref(i, n), is_default=True) for (i, n) in ACTIVITIES]}
+        if parts == ['queries']:
+            return paginate([{'id': WATCHED_QUERY_ID, 'name': "Your Watched Issues", 'is_public': True}],
+                            params, 'queries')
+    elif method == 'POST':
+        if parts[0] == 'projects' and len(parts) == 3 and parts[2] == 'issues':
+            fields = body['issue']
+            project = data.project(fields.get('project_id', parts[1]))
+            author = data.user_by_login(switch_user) if switch_user else None
+            rnd = random.Random(len(data.issues))
+            issue = data.add_issue(rnd, datetime.utcnow().replace(microsecond=0), project,
+                                   author['id'] if author else 1, int(fields.get('assigned_to_id') or 0),
+                                   int(fields.get('priority_id') or 2))
+            issue['subject'] = fields.get('subject', issue['subject'])
+            issue['status'] = ref(*STATUSES[0][:2])
+            return 201, {'issue': issue}
+        if parts == ['time_entries']:
+            fields = body['time_entry']
+            author = data.user_by_login(switch_user) if switch_user else None
+            te = data.add_time_entry(int(fields['issue_id']), author['id'] if author else 1,
+                                     float(fields['hours']), fields.get('spent_on'))
+            return 201, {'time_entry': te}
+        if parts[0] == 'issues' and len(parts) == 3 and parts[2] == 'watchers':
+            data.watchers[int(parts[1])].append(int(body['user_id']))
+            return 204, None
+    elif method == 'PUT':
+        if parts[0] == 'issues' and len(parts) == 2:
+            issue = data.issues[int(parts[1])]
+            fields = body['issue']
+            if 'status_id' in fields:
+                issue['status'] = ref(*[s[:2] for s in STATUSES if s[0] == int(fields['status_id'])][0])
+            if 'assigned_to_id' in fields:
+                issue['assigned_to'] = data.user_ref(int(fields['assigned_to_id']))
+            if 'priority_id' in fields:
+                issue['priority'] = ref(int(fields['priority_id']), dict(PRIORITIES)[int(fields['priority_id'])])
+            if 'done_ratio' in fields:
+                issue['done_ratio'] = int(fields['done_ratio'])
+            issue['updated_on'] = redmine_time(datetime.utcnow())
+            return 204, None
+    elif method == 'DELETE':
+        if parts[0] == 'issues' and len(parts) == 4 and parts[2] == 'watchers':
+            watchers = data.watchers[int(parts[1])]
+            if int(parts[3]) in watchers:
+                watchers.remove(int(parts[3]))
+            return 204, None
+    return 404, None
+
+def match_values(value, expression):
+    return str(value) in str(expression).replace(',', '|').split('|')
+
+def match_date(value, expression):
+    day = value[:10]
+    if expression.startswith('><'):
+        (start, end) = expression[2:].split('|')
+        return start <= day <= end
+    if expression.startswith('>='):
+        bound = expression[2:]
+        return value >= bound if 'T' in bound else day >= bound
+    return day == expression
+
+def filter_issues(data, params, switch_user):
+    closed = dict((i, c) for (i, n, c) in STATUSES)
+    status = params.get('status_id', 'open')
+    result = []
+    for issue in data.issues.values():
+        sid = issue['status']['id']
+        if status == 'open' and closed[sid]:
+            continue
+        if status == 'closed' and not closed[sid]:
+            continue
+        if status not in ('open', 'closed', '*') and not match_values(sid, status):
+            continue
+        if 'query_id' in params:
+            # the saved query as set up on the server: open issues the
+            # switched-to user watches but is not assigned
+            user = data.user_by_login(switch_user)
+            if closed[sid] or not user or user['id'] not in data.watchers[issue['id']] \
+              or issue.get('assigned_to', {}).get('id') == user['id']:
+                continue
+        assigned = params.get('assigned_to_id')
+        if assigned == '!*' and 'assigned_to' in issue:
+            continue
+        if assigned and assigned != '!*' and not match_values(issue.get('assigned_to', {}).get('id'), assigned):
+            continue
+        if 'author_id' in params and not match_values(issue['author']['id'], params['author_id']):
+            continue
+        if 'priority_id' in params and not match_values(issue['priority']['id'], params['priority_id']):
+            continue
+        if 'issue_id' in params and not match_values(issue['id'], params['issue_id']):
+            continue
+        if 'project_id' in params:
+            project = data.project(params['project_id'])
+            if not project or issue['project']['id'] != project['id']:
+                continue
+        if 'updated_on' in params and not match_date(issue['updated_on'], params['updated_on']):
+            continue
+        result.append(issue)
+    # like Redmine, ties in the requested sort fall back to newest first
+    result.sort(key=lambda i: i['id'], reverse=True)
+    for key in reversed(params.get('sort', 'id:desc').split(',')):
+        (field, _, direction) = key.partition(':')
+        if field == 'priority':
+            keyfn = lambda i: i['priority']['id']
+        else:
+            keyfn = lambda i, f=field: i.get(f) or 0
+        result.sort(key=keyfn, reverse=(direction == 'desc'))
+    return result
+
+def filter_time_entries(data, params):
+    result = []
+    for te in sorted(data.time_entries.values(), key=lambda t: t['id']):
+        if 'issue_id' in params and not match_values(te['issue']['id'], params['issue_id']):
+            continue
+        if 'user_id' in params and not match_values(te['user']['id'], params['user_id']):
+            continue
+        if 'project_id' in params:
+            project = data.project(params['project_id'])
+            if not project or te['project']['id'] != project['id']:
+                continue
+        # python-redmine sends the from_date filter as `from`
+        since = params.get('from', params.get('from_date'))
+        if since and te['spent_on'] < str(since):
+            continue
+        result.append(te)
+    return result
+
+class FakeSlack(object):
+    """
+        Stand-in for SlackClient: answers the Web API methods the bot uses,
+        counts calls per method and feeds queued RTM events to rtm_read
+    """
+    def __init__(self, dataset, latency=0.0, page_size=200):
+        self.latency = latency
+        self.page_size = page_size
+        self.calls = defaultdict(int)
+        self.durations = defaultdict(float)
+        self.messages = []
+        self.events = []
+        self.lock = threading.Lock()
+        self.server = None
+        self.members = [{'id': "U"+str(u['id']), 'name': u['login'], 'deleted': False,
+                         'profile': {'first_name': u['firstname'], 'last_name': u['lastname'],
+                                     'display_name': u['login']}}
+                        for u in sorted(dataset.users.values(), key=lambda u: u['id'])]
+        self.members.append({'id': BOT_ENV['BOT_ID'], 'name': 'redminebot', 'profile': {}})
+
+    def reset_counts(self):
+        with self.lock:
+            self.calls.clear()
+            self.durations.clear()
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def rtm_connect(self, **kwargs):
+        return True
+
+    def rtm_read(self):
+        with self.lock:
+            events, self.events = self.events, []
+        return events
+
+    def push_events(self, events):
+        with self.lock:
+            self.events.extend(events)
+
+    def api_call(self, method, **kwargs):
+        start = time.time()
+        if self.latency:
+            time.sleep(self.latency)
+        response = {'ok': False, 'error': 'unknown_method'}
+        if method == 'users.list':
+            offset = int(kwargs.get('cursor') or 0)
+            limit = int(kwargs.get('limit') or len(self.members))
+            next_cursor = str(offset + limit) if offset + limit < len(self.members) else ""
+            response = {'ok': True, 'members': self.members[offset:offset + limit],
+                        'response_metadata': {'next_cursor': next_cursor}}
+        elif method == 'users.info':
+            for member in self.members:
+                if member['id'] == kwargs.get('user'):
+                    response = {'ok': True, 'user': member}
+                    break
+            else:
+                response = {'ok': False, 'error': 'user_not_found'}
+        elif method in ('chat.postMessage', 'chat.update'):
+            with self.lock:
+                ts = kwargs.get('ts') or "%.6f" % time.time()
+                self.messages.append(dict(kwargs, method=method, ts=ts, posted=time.time()))
+            response = {'ok': True, 'channel': kwargs.get('channel'), 'ts': ts}
+        with self.lock:
+            self.calls[method] += 1
+            self.durations[method] += time.time() - start
+        return response
@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from benchmarks import fakes
+from benchmarks.commands import VERBS
+
+"""
+    Load generator for the RTM loop
+
+    Feeds the bot's real RTM loop a stream of mentions at a fixed rate
+    from many users and channels, against the in-process fake Redmine and
+    Slack, and reports sustained commands per second, mention to reply
+    latency percentiles, dropped messages and memory growth.
+
+    python -m benchmarks.load --rate 20 --duration 60 --workers 8
+    python -m benchmarks.load --mix scrum=5,list=3,link=2 --rate 50
+"""
+# Stand-up spike: mostly scrums and listings, some updates and links
+DEFAULT_MIX = "scrum=6,list=3,link=3,update=2,eod=1,listall=1,t5=1,close=1"
+# Suffix of a reply that will be updated again
+PROGRESS_SUFFIX = "_Loading..._\n"
+BUSY_TEXT = ":hourglass: Busy"
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+def rss_mb():
+    """
+        Resident memory of this process; peak RSS where /proc is missing
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1048576.0
+    except (IOError, OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+class LoadSlack(fakes.FakeSlack):
+    """
+        Fake Slack whose RTM socket wakes the bot's event mode and which
+        matches each final reply to its mention by the `ts` of the command
+        being run on the replying thread
+    """
+    def __init__(self, dataset, latency=0.0):
+        fakes.FakeSlack.__init__(self, dataset, latency)
+        (self.wake_read, self.wake_write) = socket.socketpair()
+        self.wake_read.setblocking(False)
+        websocket = type('WebSocket', (object,), {'sock': self.wake_read})()
+        self.server = type('Server', (object,), {'websocket': websocket})()
+        self.open = {}
+        self.last_ts = 0.0
+        self.local = threading.local()
+        self.latencies = defaultdict(list)
+        self.answered = []
+        self.sent = 0
+        self.busy = 0
+
+    def mention(self, text, channel, user, verb):
+        now = time.time()
+        with self.lock:
+            # message timestamps are unique per channel in Slack
+            self.last_ts = max(now, self.last_ts + 0.000001)
+            ts = "%.6f" % self.last_ts
+            self.open[ts] = (now, verb)
+            self.sent += 1
+        self.push_events([{'type': 'message', 'channel': channel, 'user': user,
+                           'text': "<@"+fakes.BOT_ENV['BOT_ID']+"> "+text, 'ts': ts}])
+        self.wake_write.send(b"x")
+
+    def track(self, fn):
+        """
+            Wrap the bot's dispatch_command/run_command so replies posted
+            while a command runs can be traced back to its mention
+        """
+        def tracked(command, channel, user, ts=None):
+            previous = getattr(self.local, 'ts', None)
+            self.local.ts = ts
+            try:
+                return fn(command, channel, user, ts)
+            finally:
+                self.local.ts = previous
+        return tracked
+
+    def rtm_read(self):
+        try:
+            while self.wake_read.recv(4096):
+                pass
+        except (IOError, OSError):
+            pass
+        return fakes.FakeSlack.rtm_read(self)
+
+    def api_call(self, method, **kwargs):
+        response = fakes.FakeSlack.api_call(self, method, **kwargs)
+        text = kwargs.get('text') or ""
+        if method in ('chat.postMessage', 'chat.update') and not text.endswith(PROGRESS_SUFFIX):
+            now = time.time()
+            with self.lock:
+                mention = self.open.pop(getattr(self.local, 'ts', None), None)
+                if mention is not None:
+                    (sent, verb) = mention
+                    if BUSY_TEXT in text:
+                        self.busy += 1
+                    else:
+                        self.latencies[verb].append(now - sent)
+                        self.answered.append(now)
+        return response
+
+    def unanswered(self):
+        with self.lock:
+            return len(self.open)
+
+def parse_mix(mix):
+    commands = dict(VERBS)
+    weights = []
+    for item in mix.split(','):
+        (verb, weight) = item.split('=')
+        if verb not in commands:
+            raise SystemExit("unknown verb in --mix: "+verb)
+        weights.append((verb, float(weight)))
+    return (commands, weights)
+
+def choose(weights, rand):
+    total = sum(weight for (verb, weight) in weights)
+    pick = rand.uniform(0, total)
+    for (verb, weight) in weights:
+        pick -= weight
+        if pick <= 0:
+            return verb
+    return weights[-1][0]
+
+def setup(args):
+    """
+        Start the fakes and import the bot pointed at them, as the bot's
+        main block would before entering the RTM loop
+    """
+    data = fakes.Dataset(users=args.users, projects=args.projects, \
+                         issues_per_user=args.issues_per_user)
+    redmine = fakes.FakeRedmine(data, latency=args.redmine_latency / 1000.0).start()
+    slack = LoadSlack(data, latency=args.slack_latency / 1000.0)
+    os.environ.update(fakes.BOT_ENV)
+    os.environ.update({'REDMINE_HOST': redmine.url, 'RTM_READ_MODE': 'event',
+                       'BOT_WORKERS': str(args.workers), 'BOT_QUEUE_DEPTH': str(args.queue)})
+    import redminebot
+    redminebot.sc = slack
+    redminebot.dispatch_command = slack.track(redminebot.dispatch_command)
+    redminebot.run_command = slack.track(redminebot.run_command)
+    redminebot.SLACK_DIRECTORY.load(slack)
+    redminebot.CATALOG.load()
+    if redminebot.EXECUTOR is not None:
+        redminebot.EXECUTOR.start()
+    return (redminebot, redmine, slack)
+
+def run(bot, slack, args):
+    (commands, weights) = parse_mix(args.mix)
+    rand = random.Random(args.seed)
+    running = [True]
+    loop = threading.Thread(target=bot.rtm_loop, args=(lambda: running[0],), name='rtm')
+    loop.daemon = True
+    loop.start()
+    samples = []
+    start = time.time()
+    next_sample = start
+    # open loop: mentions keep their schedule however far behind the bot is
+    for i in range(int(args.rate * args.duration)):
+        due = start + i / float(args.rate)
+        while True:
+            now = time.time()
+            if now >= next_sample:
+                samples.append(sample(bot, slack, now - start))
+                next_sample += args.sample
+            if now >= due:
+                break
+            time.sleep(min(due, next_sample) - now)
+        verb = choose(weights, rand)
+        user = "U"+str(rand.randint(1, args.users))
+        channel = "C"+str(rand.randint(1, args.channels))
+        slack.mention(commands[verb], channel, user, verb)
+    sent_end = time.time()
+    while slack.unanswered() and time.time() - sent_end < args.drain:
+        time.sleep(0.05)
+        if time.time() >= next_sample:
+            samples.append(sample(bot, slack, time.time() - start))
+            next_sample += args.sample
+    samples.append(sample(bot, slack, time.time() - start))
+    running[0] = False
+    slack.wake_write.send(b"x")
+    loop.join(5)
+    return (start, sent_end, samples)
+
+def sample(bot, slack, elapsed):
+    depth = bot.EXECUTOR.depth if bot.EXECUTOR is not None else 0
+    return {'t': round(elapsed, 1), 'rss_mb': round(rss_mb(), 1), 'queue': depth,
+            'answered': len(slack.answered)}
+
+def report(bot, slack, start, sent_end, samples):
+    latencies = [l for values in slack.latencies.values() for l in values]
+    answered = sorted(slack.answered)
+    duration = (answered[-1] - start) if answered else 0
+    result = {
+        'sent': slack.sent,
+        'answered': len(answered),
+        'busy': slack.busy,
+        'unanswered': slack.unanswered(),
+        'offered_per_sec': round(slack.sent / max(sent_end - start, 1e-9), 2),
+        'sustained_per_sec': round(len(answered) / duration, 2) if duration else 0.0,
+        'latency_ms': dict((name, round(percentile(latencies, p) * 1000, 1)) \
+                           for (name, p) in (('p50', 50), ('p95', 95), ('p99', 99))),
+        'verbs': dict((verb, {'count': len(values), \
+                              'p95_ms': round(percentile(values, 95) * 1000, 1)}) \
+                      for (verb, values) in slack.latencies.items()),
+        'rss_growth_mb': round(samples[-1]['rss_mb'] - samples[0]['rss_mb'], 1),
+        'samples': samples,
+        'classes': bot.EXECUTOR.stats() if bot.EXECUTOR is not None else {}
+    }
+    out = sys.stdout
+    out.write("sent %d, answered %d, dropped %d (%d busy, %d unanswered)\n" % (result['sent'], \
+              result['answered'], result['busy'] + result['unanswered'], result['busy'], result['unanswered']))
+    out.write("offered %.2f cmds/s, sustained %.2f cmds/s\n" % (result['offered_per_sec'], result['sustained_per_sec']))
+    out.write("latency p50 %(p50).1f ms, p95 %(p95).1f ms, p99 %(p99).1f ms\n" % result['latency_ms'])
+    for (verb, stats) in sorted(result['verbs'].items()):
+        out.write("  %-10s %6d answered, p95 %8.1f ms\n" % (verb, stats['count'], stats['p95_ms']))
+    out.write("%8s %8s %8s %8s\n" % ("t (s)", "rss MB", "queue", "answered"))
+    for s in samples:
+        out.write("%8.1f %8.1f %8d %8d\n" % (s['t'], s['rss_mb'], s['queue'], s['answered']))
+    out.write("memory growth %.1f MB\n" % result['rss_growth_mb'])
+    for (name, stats) in sorted(result['classes'].items()):
+        out.write("queue %-10s %6d started, %4d rejected, wait avg %8.1f ms, max %8.1f ms\n" % \
+                  (name, stats['started'], stats['rejected'], stats['wait_avg_ms'], stats['wait_max_ms']))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the RTM loop with synthetic mentions")
+    parser.add_argument('--rate', type=float, default=10.0, help="mentions per second")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds to send mentions for")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="comma separated verb=weight pairs")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--channels', type=int, default=5)
+    parser.add_argument('--projects', type=int, default=5)
+    parser.add_argument('--issues-per-user', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=4, help="BOT_WORKERS; 0 runs commands inline")
+    parser.add_argument('--queue', type=int, default=100, help="BOT_QUEUE_DEPTH")
+    parser.add_argument('--redmine-latency', type=float, default=0.0, help="ms added to each Redmine call")
+    parser.add_argument('--slack-latency', type=float, default=0.0, help="ms added to each Slack call")
+    parser.add_argument('--drain', type=float, default=30.0, help="seconds to wait for replies after sending")
+    parser.add_argument('--sample', type=float, default=5.0, help="seconds between memory samples")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help="write results to this JSON file")
+    args = parser.parse_args()
+
+    (bot, redmine, slack) = setup(args)
+    (start, sent_end, samples) = run(bot, slack, args)
+    result = report(bot, slack, start, sent_end, samples)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'config': vars(args), 'results': result}, f, indent=2, sort_keys=True)
+    redmine.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import os
+import sys
+import time
+
+from benchmarks import fakes
+
+"""
+    Microbenchmark for issue line rendering
+
+    Renders a report of `--issues` issues through issue_detail,
+    issue_detail_hours and top5_detail, first with an empty issue line
+    cache and then again with the fragments already cached, as happens
+    for repeated scrums in a day. No Redmine or Slack calls are made.
+"""
+def load_bot():
+    os.environ.update(fakes.BOT_ENV)
+    os.environ.setdefault('REDMINE_HOST', "http://localhost:1")
+    import redminebot
+    return redminebot
+
+def make_issues(bot, count):
+    users = max(1, count // 20)
+    data = fakes.Dataset(users=users, issues_per_user=20, entries_per_issue=0, journals_per_issue=0)
+    issues = []
+    for iid in sorted(data.issues)[:count]:
+        raw = dict(data.issues[iid])
+        raw['watchers'] = [data.user_ref(u) for u in data.watchers[iid]]
+        issues.append(bot.rc.issue.to_resource(raw))
+    return issues
+
+def render_report(bot, issues, hours):
+    lines = []
+    for (n, issue) in enumerate(issues):
+        if n % 3 == 0:
+            lines.append(bot.issue_detail(issue, extended=True, user=True, hours=hours))
+        elif n % 3 == 1:
+            lines.append(bot.issue_detail_hours(issue, hours[issue.id], hours=hours))
+        else:
+            lines.append(bot.top5_detail(issue, 1 + n % 5, hours=hours))
+    return "".join(lines)
+
+def timed(fn, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Time issue line rendering")
+    parser.add_argument('--issues', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    bot = load_bot()
+    issues = make_issues(bot, args.issues)
+    hours = dict((issue.id, 1.5) for issue in issues)
+
+    def cold():
+        bot.ISSUE_LINE_CACHE.invalidate()
+        render_report(bot, issues, hours)
+
+    def warm():
+        render_report(bot, issues, hours)
+
+    cold_time = timed(cold, args.repeat)
+    warm()
+    warm_time = timed(warm, args.repeat)
+    size = len(render_report(bot, issues, hours))
+
+    sys.stdout.write("issues:            "+str(len(issues))+"\n")
+    sys.stdout.write("report size:       "+str(size)+" chars\n")
+    sys.stdout.write("cold cache:        %.2f ms\n" % (cold_time * 1000))
+    sys.stdout.write("warm cache:        %.2f ms\n" % (warm_time * 1000))
+    sys.stdout.write("per issue (warm):  %.1f us\n" % (warm_time * 1000000 / max(1, len(issues))))
+    sys.stdout.write("line cache:        "+str(bot.ISSUE_LINE_CACHE.stats())+"\n")
+
+if __name__ == "__main__":
+    main()
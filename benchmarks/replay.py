@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+from collections import defaultdict, deque
+
+import requests
+
+from benchmarks import fakes
+from benchmarks.commands import VERBS, BENCH_CHANNEL, BENCH_LOGIN, BENCH_USER
+
+"""
+    Record and replay Redmine and Slack traffic
+
+    `record` runs commands against the configured Redmine and Slack (or
+    the in-process fakes with --fake) and saves every request/response
+    pair to a fixture file. `replay` runs the same commands offline,
+    answering each request from the fixture, and fails when a command
+    makes a request that was never recorded or more calls than its
+    budget allows. Every HTTP request counts against the budget, later
+    pages of a list included.
+
+    python -m benchmarks.replay record --fake benchmarks/fixtures/commands.json
+    python -m benchmarks.replay replay benchmarks/fixtures/commands.json \\
+        --budgets benchmarks/budgets.json
+"""
+# Settings copied into fixtures; tokens and hosts are never saved
+FIXTURE_ENV = ['REDMINE_EXT_HOST', 'REDMINE_VERSION', 'REDMINE_NEW_ID',
+               'REDMINE_INPROGRESS_ID', 'REDMINE_RESOLVED_ID', 'REDMINE_FEEDBACK_ID',
+               'REDMINE_CLOSED_ID', 'REDMINE_REJECTED_ID', 'REDMINE_HOLD_ID',
+               'REDMINE_ACTIVITY_ID', 'REDMINE_PROJECT', 'REDMINE_TOP5_PROJECT',
+               'REDMINE_TRACKER_ID', 'REDMINE_WATCHED_QUERY_ID', 'BOT_ID']
+REPLAY_HOST = "http://redmine.replay"
+# Slack calls answered without a recording; only their text differs
+SLACK_POSTS = ('chat.postMessage', 'chat.update')
+
+DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}:\d{2}Z)?")
+
+def normalize(value):
+    """
+        Replace dates so requests made on another day still match
+    """
+    if isinstance(value, dict):
+        return dict((k, normalize(v)) for (k, v) in value.items())
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, (str, type(u""))):
+        return DATE_RE.sub("<date>", value)
+    return value
+
+def redmine_key(method, url, kwargs):
+    path = re.sub(r'^[a-z]+://[^/]+', '', url)
+    params = dict((k, str(v)) for (k, v) in (kwargs.get('params') or {}).items())
+    data = kwargs.get('data')
+    body = None
+    if data and isinstance(data, (str, type(u""), bytes)):
+        body = json.loads(data)
+    switch_user = (kwargs.get('headers') or {}).get('X-Redmine-Switch-User')
+    return json.dumps([method.upper(), path, switch_user, normalize(params), normalize(body)], sort_keys=True)
+
+def slack_key(method, kwargs):
+    args = dict((k, v) for (k, v) in kwargs.items() if k not in ('text', 'ts'))
+    return json.dumps([method, normalize(args)], sort_keys=True, default=str)
+
+class Step(object):
+    """
+        Traffic of one command (or of bot startup when `command` is None)
+    """
+    def __init__(self, command=None, redmine=None, slack=None, reply=None):
+        self.command = command
+        self.redmine = redmine or []
+        self.slack = slack or []
+        self.reply = reply
+
+    def to_json(self):
+        return {'command': self.command, 'redmine': self.redmine, 'slack': self.slack, 'reply': self.reply}
+
+class Recorder(object):
+    """
+        Wraps the shared Redmine session and the Slack client, appending
+        every exchange to the current step
+    """
+    def __init__(self, session, slack):
+        self.session_request = session.request
+        self.slack = slack
+        self.step = Step()
+        self.lock = threading.Lock()
+        session.request = self.redmine_request
+
+    def redmine_request(self, method, url, **kwargs):
+        response = self.session_request(method, url, **kwargs)
+        with self.lock:
+            self.step.redmine.append({'key': redmine_key(method, url, kwargs),
+                                      'status': response.status_code,
+                                      'body': response.text})
+        return response
+
+    def api_call(self, method, *args, **kwargs):
+        result = self.slack.api_call(method, *args, **kwargs)
+        with self.lock:
+            self.step.slack.append({'key': slack_key(method, kwargs), 'result': result})
+            if method in SLACK_POSTS:
+                self.step.reply = kwargs.get('text')
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.slack, name)
+
+class Replayer(object):
+    """
+        Answers Redmine and Slack calls from a recorded step, counting the
+        calls made and any that were not recorded
+    """
+    def __init__(self, session):
+        session.request = self.redmine_request
+        self.lock = threading.Lock()
+        self.start(Step())
+
+    def start(self, step):
+        self.redmine = defaultdict(deque)
+        self.slack = defaultdict(deque)
+        for exchange in step.redmine:
+            self.redmine[exchange['key']].append(exchange)
+        for exchange in step.slack:
+            self.slack[exchange['key']].append(exchange)
+        self.redmine_calls = 0
+        self.slack_calls = 0
+        self.missing = []
+        self.reply = None
+
+    def redmine_request(self, method, url, **kwargs):
+        key = redmine_key(method, url, kwargs)
+        with self.lock:
+            self.redmine_calls += 1
+            queue = self.redmine.get(key)
+            if not queue:
+                self.missing.append("redmine "+key)
+                exchange = {'status': 404, 'body': ""}
+            elif len(queue) > 1:
+                exchange = queue.popleft()
+            else:
+                # repeat the last answer if the bot asks more often
+                exchange = queue[0]
+        response = requests.models.Response()
+        response.status_code = exchange['status']
+        response._content = exchange['body'].encode('utf-8')
+        response.headers['Content-Type'] = 'application/json'
+        response.url = url
+        return response
+
+    def api_call(self, method, *args, **kwargs):
+        with self.lock:
+            self.slack_calls += 1
+            if method in SLACK_POSTS:
+                self.reply = kwargs.get('text')
+                return {'ok': True, 'channel': kwargs.get('channel'), 'ts': "1.000000"}
+            queue = self.slack.get(slack_key(method, kwargs))
+            if not queue:
+                self.missing.append("slack "+slack_key(method, kwargs))
+                return {'ok': False, 'error': 'not_recorded'}
+            return (queue.popleft() if len(queue) > 1 else queue[0])['result']
+
+def load_bot(env):
+    os.environ.update(env)
+    import redminebot
+    return redminebot
+
+def startup(bot):
+    bot.SLACK_DIRECTORY.load(bot.sc)
+    bot.CATALOG.load()
+
+def record(args):
+    env = {}
+    if args.fake:
+        data = fakes.Dataset(users=args.users, issues_per_user=args.issues_per_user)
+        server = fakes.FakeRedmine(data).start()
+        env.update(fakes.BOT_ENV)
+        env['REDMINE_HOST'] = server.url
+        bot = load_bot(env)
+        bot.sc = fakes.FakeSlack(data)
+    else:
+        bot = load_bot(env)
+    recorder = Recorder(bot.REDMINE_SESSION, bot.sc)
+    bot.sc = recorder
+    steps = []
+    startup(bot)
+    steps.append(recorder.step)
+    for command in args.commands or [command for (verb, command) in VERBS]:
+        recorder.step = Step(command)
+        bot.handle_command(command, args.channel, args.user, args.username)
+        steps.append(recorder.step)
+        sys.stdout.write("%-40s %4d redmine %4d slack\n" % (command, len(recorder.step.redmine), len(recorder.step.slack)))
+    fixture = {
+        'env': dict((k, os.environ.get(k)) for k in FIXTURE_ENV if os.environ.get(k) is not None),
+        'user': args.user,
+        'username': args.username,
+        'channel': args.channel,
+        'steps': [step.to_json() for step in steps]
+    }
+    with open(args.fixture, 'w') as f:
+        json.dump(fixture, f, indent=1, sort_keys=True)
+
+def replay(args):
+    with open(args.fixture) as f:
+        fixture = json.load(f)
+    budgets = {}
+    if args.budgets:
+        with open(args.budgets) as f:
+            budgets = json.load(f)
+    env = dict(fixture['env'])
+    env.update({'REDMINE_HOST': REPLAY_HOST, 'REDMINE_TOKEN': "replay", 'BOT_TOKEN': "replay"})
+    bot = load_bot(env)
+    replayer = Replayer(bot.REDMINE_SESSION)
+    bot.sc = replayer
+    failures = []
+    for data in fixture['steps']:
+        step = Step(data['command'], data['redmine'], data['slack'], data['reply'])
+        replayer.start(step)
+        if step.command is None:
+            startup(bot)
+            continue
+        bot.handle_command(step.command, fixture['channel'], fixture['user'], fixture['username'])
+        verb = bot.command_operator(step.command)
+        budget = budgets.get(verb, {})
+        status = []
+        if replayer.missing:
+            status.append(str(len(replayer.missing))+" unrecorded")
+            failures.extend(step.command+": "+m for m in replayer.missing)
+        for (backend, calls) in (('redmine', replayer.redmine_calls), ('slack', replayer.slack_calls)):
+            if backend in budget and calls > budget[backend]:
+                status.append(backend+" over budget")
+                failures.append(step.command+": "+str(calls)+" "+backend+" calls, budget " \
+                                +str(budget[backend]))
+        if args.check_output and replayer.reply != step.reply:
+            status.append("reply differs")
+            failures.append(step.command+": reply differs from the recording")
+        sys.stdout.write("%-40s %4d/%-4s redmine %4d/%-4s slack  %s\n" % (step.command, \
+            replayer.redmine_calls, budget.get('redmine', '-'), replayer.slack_calls, \
+            budget.get('slack', '-'), ", ".join(status) or "ok"))
+    for failure in failures:
+        sys.stdout.write("FAIL "+failure+"\n")
+    return 1 if failures else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay bot traffic")
+    sub = parser.add_subparsers(dest='mode')
+    rec = sub.add_parser('record', help="run commands and save their traffic")
+    rec.add_argument('fixture')
+    rec.add_argument('commands', nargs='*', help="commands to run; every verb by default")
+    rec.add_argument('--fake', action='store_true', help="record against the in-process fakes")
+    rec.add_argument('--users', type=int, default=5)
+    rec.add_argument('--issues-per-user', type=int, default=8)
+    rec.add_argument('--user', default=BENCH_USER, help="Slack user ID sending the commands")
+    rec.add_argument('--username', default=BENCH_LOGIN, help="Redmine login of that user")
+    rec.add_argument('--channel', default=BENCH_CHANNEL)
+    rep = sub.add_parser('replay', help="replay a fixture offline")
+    rep.add_argument('fixture')
+    rep.add_argument('--budgets', help="JSON file of per-verb call budgets")
+    rep.add_argument('--check-output', action='store_true',
+                     help="also fail when a reply differs from the recording")
+    args = parser.parse_args()
+    if args.mode == 'record':
+        record(args)
+    elif args.mode == 'replay':
+        sys.exit(replay(args))
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
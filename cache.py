@@ -0,0 +1,79 @@
+import time
+import threading
+from collections import OrderedDict
+
+"""
+    Bounded LRU cache with optional time-to-live
+"""
+class LRUCache(object):
+    """
+        Thread-safe least-recently-used cache
+
+        Entries older than `ttl` seconds are treated as misses and dropped;
+        a `ttl` of None keeps entries until they are evicted or invalidated.
+        Once `maxsize` entries are stored the least recently used one is
+        evicted to make room for the next.
+    """
+    def __init__(self, name, maxsize=1024, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                value, stored = self._data.pop(key)
+                if self.ttl is None or time.time() - stored < self.ttl:
+                    # re-insert to mark as most recently used
+                    self._data[key] = (value, stored)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._data:
+                del self._data[key]
+            elif len(self._data) >= self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            self._data[key] = (value, time.time())
+
+    def invalidate(self, key=None):
+        """
+            Drop a single key, or every entry when no key is given
+        """
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            elif key in self._data:
+                del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return float(self.hits) / total
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate()
+        }
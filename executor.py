@@ -0,0 +1,175 @@
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+"""
+    Worker pool that keeps tasks for the same key in order
+"""
+class TaskClass(object):
+    """
+        Queue of one cost class: users with ready tasks take turns, and
+        keys ready for each user are kept in the order they became ready
+    """
+    def __init__(self, name, weight=1, limit=None):
+        self.name = name
+        self.weight = weight
+        self.limit = limit
+        self.current = 0
+        self.users = deque()
+        self.keys = {}
+        self.queued = 0
+        self.running = 0
+        self.started = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def runnable(self):
+        return len(self.users) > 0 and (self.limit is None or self.running < self.limit)
+
+    def push(self, user, key):
+        if user not in self.keys:
+            self.keys[user] = deque()
+            self.users.append(user)
+        self.keys[user].append(key)
+
+    def pop(self):
+        user = self.users.popleft()
+        keys = self.keys[user]
+        key = keys.popleft()
+        if keys:
+            # back of the line so other users go first
+            self.users.append(user)
+        else:
+            del self.keys[user]
+        return key
+
+    def stats(self):
+        return {
+            'weight': self.weight,
+            'limit': self.limit,
+            'queued': self.queued,
+            'running': self.running,
+            'started': self.started,
+            'rejected': self.rejected,
+            'wait_avg_ms': round(self.wait_total * 1000 / self.started, 1) if self.started else 0.0,
+            'wait_max_ms': round(self.wait_max * 1000, 1)
+        }
+
+class CommandExecutor(object):
+    """
+        Runs submitted tasks on a fixed pool of worker threads
+
+        Tasks sharing a key run one at a time in the order they were
+        submitted, while tasks for different keys run in parallel. Every
+        task belongs to a cost class given as `(name, weight, limit)`:
+        free workers pick among classes with waiting tasks in proportion to
+        their weights, a class never runs more than `limit` tasks at once
+        (None for no limit), and within a class the users that submitted
+        tasks take turns. At most `max_queue` tasks of each class may wait,
+        and at most `max_per_user` from one user; `submit` returns False
+        instead of blocking once either limit is reached.
+
+        `on_start`, when given, is called with the class name and the
+        seconds the task waited each time a task starts.
+    """
+    def __init__(self, workers=4, max_queue=100, name='command', classes=None, \
+                 max_per_user=None, on_start=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.name = name
+        self.on_start = on_start
+        self.depth = 0
+        self.rejected = 0
+        self.classes = [TaskClass(*c) for c in (classes or [('default', 1, None)])]
+        self._by_name = dict((c.name, c) for c in self.classes)
+        self._user_depth = {}
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=self.name+"-"+str(i))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, key, fn, args=(), cost=None, user=None):
+        task_class = self._by_name[cost or self.classes[0].name]
+        with self._cond:
+            if task_class.queued >= self.max_queue or (self.max_per_user is not None and \
+                    self._user_depth.get(user, 0) >= self.max_per_user):
+                self.rejected += 1
+                task_class.rejected += 1
+                return False
+            self.depth += 1
+            self._user_depth[user] = self._user_depth.get(user, 0) + 1
+            task_class.queued += 1
+            task = (fn, args, task_class, user, time.time())
+            if key in self._pending:
+                # a task for this key is queued or running; it will
+                # reschedule the key when it finishes
+                self._pending[key].append(task)
+            else:
+                self._pending[key] = deque([task])
+                task_class.push(user, key)
+                self._cond.notify()
+            return True
+
+    def _next(self):
+        """
+            Smooth weighted round robin over the classes that can run a
+            task now; returns None when none can
+        """
+        runnable = [c for c in self.classes if c.runnable()]
+        if not runnable:
+            return None
+        for c in runnable:
+            c.current += c.weight
+        chosen = max(runnable, key=lambda c: c.current)
+        chosen.current -= sum(c.weight for c in runnable)
+        key = chosen.pop()
+        (fn, args, task_class, user, submitted) = self._pending[key].popleft()
+        self.depth -= 1
+        self._user_depth[user] -= 1
+        if not self._user_depth[user]:
+            del self._user_depth[user]
+        chosen.queued -= 1
+        chosen.running += 1
+        chosen.started += 1
+        wait = time.time() - submitted
+        chosen.wait_total += wait
+        chosen.wait_max = max(chosen.wait_max, wait)
+        return (key, fn, args, chosen, wait)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                task = self._next()
+                while task is None:
+                    self._cond.wait()
+                    task = self._next()
+            (key, fn, args, task_class, wait) = task
+            try:
+                if self.on_start is not None:
+                    self.on_start(task_class.name, wait)
+                fn(*args)
+            except:
+                traceback.print_exc(file=sys.stderr)
+            with self._cond:
+                task_class.running -= 1
+                if self._pending[key]:
+                    (fn, args, next_class, user, submitted) = self._pending[key][0]
+                    next_class.push(user, key)
+                else:
+                    del self._pending[key]
+                # a class below its limit again may have tasks waiting
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return dict((c.name, c.stats()) for c in self.classes)
@@ -0,0 +1,177 @@
+import sys
+import threading
+import traceback
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+"""
+    Prometheus text format metrics
+"""
+# Latency buckets in seconds, from a cached lookup to a slow report
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for (name, value) in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(name+'="'+value+'"')
+    return "{"+",".join(pairs)+"}"
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Counter(object):
+    """
+        Monotonic count per label set
+    """
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self.labels, labels, value) \
+                    for (labels, value) in sorted(self.values.items())]
+
+class Histogram(object):
+    """
+        Cumulative bucket counts, sum and count per label set
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for (i, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        samples = []
+        names = self.labels + ('le',)
+        with self._lock:
+            for (labels, (counts, total, count)) in sorted(self.values.items()):
+                cumulative = 0
+                for (bound, n) in zip(self.buckets, counts):
+                    cumulative += n
+                    samples.append((self.name+"_bucket", names, labels + (format_value(float(bound)),), cumulative))
+                samples.append((self.name+"_sum", self.labels, labels, total))
+                samples.append((self.name+"_count", self.labels, labels, count))
+        return samples
+
+class Gauge(object):
+    """
+        Values read when metrics are scraped; `collect` returns a list of
+        (label values, value) pairs
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def samples(self):
+        return [(self.name, self.labels, labels, value) for (labels, value) in self.collect()]
+
+class CollectedCounter(Gauge):
+    """
+        Running totals kept elsewhere, read when metrics are scraped like a
+        gauge but exposed as a counter
+    """
+    kind = 'counter'
+
+class MetricsRegistry(object):
+    """
+        Named metrics rendered together in the Prometheus text format
+    """
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, labels=(), collect=None):
+        return self.register(Gauge(name, help, labels, collect))
+
+    def collected_counter(self, name, help, labels=(), collect=None):
+        return self.register(CollectedCounter(name, help, labels, collect))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = metric.samples()
+            except:
+                # one failing gauge should not hide the other metrics
+                traceback.print_exc(file=sys.stderr)
+                continue
+            lines.append("# HELP "+metric.name+" "+metric.help)
+            lines.append("# TYPE "+metric.name+" "+metric.kind)
+            for (name, names, values, value) in samples:
+                lines.append(name+format_labels(names, values)+" "+format_value(value))
+        return "\n".join(lines)+"\n"
+
+def start_metrics_server(registry, port, address=''):
+    """
+        Serve `registry` at /metrics from a daemon thread
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            out = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+    server = HTTPServer((address, port), Handler)
+    t = threading.Thread(target=server.serve_forever, name='metrics')
+    t.daemon = True
+    t.start()
+    return server
@@ -0,0 +1,332 @@
+import json
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from datetime import timedelta
+
+"""
+    Local SQLite mirror of Redmine issues, watched issues and time entries
+"""
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS issues (id INTEGER PRIMARY KEY, project_id INTEGER, "
+    "status_id INTEGER, assigned_to_id INTEGER, author_id INTEGER, priority_id INTEGER, "
+    "created_on TEXT, updated_on TEXT, raw TEXT)",
+    "CREATE INDEX IF NOT EXISTS issues_assigned ON issues (assigned_to_id, status_id)",
+    "CREATE INDEX IF NOT EXISTS issues_author ON issues (author_id, status_id)",
+    "CREATE INDEX IF NOT EXISTS issues_project ON issues (project_id, status_id)",
+    "CREATE INDEX IF NOT EXISTS issues_status ON issues (status_id)",
+    "CREATE INDEX IF NOT EXISTS issues_updated ON issues (updated_on)",
+    "DROP TABLE IF EXISTS watchers",
+    "CREATE TABLE IF NOT EXISTS watched (user_id INTEGER, issue_id INTEGER, "
+    "PRIMARY KEY (user_id, issue_id))",
+    "CREATE TABLE IF NOT EXISTS time_entries (id INTEGER PRIMARY KEY, issue_id INTEGER, "
+    "user_id INTEGER, hours REAL, spent_on TEXT)",
+    "CREATE INDEX IF NOT EXISTS time_entries_issue ON time_entries (issue_id)",
+    "CREATE INDEX IF NOT EXISTS time_entries_user ON time_entries (user_id, spent_on)",
+    "CREATE TABLE IF NOT EXISTS statuses (id INTEGER PRIMARY KEY, name TEXT, is_closed INTEGER)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+]
+
+# Max IDs bound into one `IN (...)` clause, below SQLite's variable limit
+SQL_IN_CHUNK = 500
+
+class MirrorResult(list):
+    """
+        Issues read from the mirror; `total_count` mirrors the attribute of
+        python-redmine result sets so paged listings work unchanged
+    """
+    def __init__(self, issues, total_count):
+        list.__init__(self, issues)
+        self.total_count = total_count
+
+class IssueMirror(object):
+    """
+        Keeps a SQLite copy of Redmine issues and time entries, indexed by
+        assignee, author, project and status
+
+        Issues are synced incrementally by polling `updated_on>=` the newest
+        update already mirrored; time entries logged in the last
+        `window_days` days are replaced on every sync. Changes Redmine does
+        not record in `updated_on` (old time entries edited, issues
+        deleted) are picked up by the periodic full resync. The issues a
+        user's watched issues query returns are fetched with that query the
+        first time they are needed after each sync.
+
+        The mirror is only `ready` once it has synced in this process, and
+        not between `request_sync` after a write and the next sync, so
+        reads never see data older than the last change the bot made.
+    """
+    def __init__(self, path, redmine, window_days=8):
+        self.path = path
+        self.rc = redmine
+        self.window_days = window_days
+        self.synced = None
+        self.sync_started = None
+        self.written = None
+        self.watched_synced = {}
+        self.syncs = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+            self._conn.commit()
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def ready(self):
+        """
+            True once a sync has completed in this process, on top of a full
+            sync, and no write has happened since that sync started
+        """
+        if self.sync_started is None or self.get_meta('resynced') is None:
+            return False
+        return self.written is None or self.written < self.sync_started
+
+    def sync(self, full=False):
+        """
+            Pull changes from Redmine; a full sync reloads everything and
+            drops rows Redmine no longer has. Returns the issues synced.
+        """
+        started = time.time()
+        watermark = self.get_meta('watermark')
+        full = full or watermark is None
+        if full:
+            statuses = [(s.id, s.name, 1 if s.raw().get('is_closed') else 0) \
+                        for s in self.rc.issue_status.all()]
+            issues = [i.raw() for i in self.rc.issue.filter(status_id='*', sort='updated_on')]
+        else:
+            statuses = None
+            issues = [i.raw() for i in self.rc.issue.filter(status_id='*', \
+                        updated_on='>='+watermark, sort='updated_on')]
+        if full:
+            time_entries = list(self.rc.time_entry.all())
+            from_date = None
+        else:
+            from_date = str((datetime.today() - timedelta(days=self.window_days)).date())
+            time_entries = list(self.rc.time_entry.filter(from_date=from_date))
+        with self._lock:
+            try:
+                self.store(issues, time_entries, statuses, from_date, full)
+                self._conn.commit()
+            except:
+                self._conn.rollback()
+                raise
+            # watched issues are fetched again when next needed
+            self.watched_synced = {}
+            self.sync_started = started
+        self.synced = time.time()
+        self.syncs += 1
+        return len(issues)
+
+    def closed_statuses(self, statuses=None):
+        if statuses is None:
+            with self._lock:
+                statuses = self._conn.execute("SELECT id, name, is_closed FROM statuses").fetchall()
+        return set(id for (id, name, is_closed) in statuses if is_closed)
+
+    def store(self, issues, time_entries, statuses, from_date, full):
+        c = self._conn
+        if full:
+            for table in ('issues', 'watched', 'time_entries', 'statuses'):
+                c.execute("DELETE FROM "+table)
+            c.executemany("INSERT INTO statuses VALUES (?, ?, ?)", statuses)
+        else:
+            c.execute("DELETE FROM time_entries WHERE spent_on >= ?", (from_date,))
+        self.store_issues(issues)
+        c.executemany("INSERT OR REPLACE INTO time_entries VALUES (?, ?, ?, ?, ?)", \
+            [(te.id, te.issue.id, te.user.id, te.hours, str(te.spent_on)) \
+             for te in time_entries if 'issue' in te.raw()])
+        if issues:
+            newest = max(raw['updated_on'] for raw in issues)
+            c.execute("INSERT OR REPLACE INTO meta VALUES ('watermark', ?)", (newest,))
+        if full:
+            c.execute("INSERT OR REPLACE INTO meta VALUES ('resynced', ?)", (str(time.time()),))
+
+    def store_issues(self, issues):
+        self._conn.executemany("INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", \
+            [(raw['id'], raw['project']['id'], raw['status']['id'], \
+              raw['assigned_to']['id'] if 'assigned_to' in raw else None, \
+              raw['author']['id'], raw['priority']['id'], raw['created_on'], \
+              raw['updated_on'], json.dumps(raw)) for raw in issues])
+
+    def sync_watched(self, userid, query):
+        """
+            Replace the watched issues of `userid` with those returned by
+            `query()`, unless already done since the last sync; the query is
+            the caller's, e.g. a saved query run as the user
+        """
+        userid = int(userid)
+        if userid in self.watched_synced:
+            return
+        started = self.sync_started
+        issues = [i.raw() for i in query()]
+        with self._lock:
+            if started != self.sync_started:
+                # a sync finished meanwhile; these issues may be older
+                return
+            try:
+                self._conn.execute("DELETE FROM watched WHERE user_id = ?", (userid,))
+                self._conn.executemany("INSERT INTO watched VALUES (?, ?)", \
+                                       [(userid, raw['id']) for raw in issues])
+                self.store_issues(issues)
+                self._conn.commit()
+            except:
+                self._conn.rollback()
+                raise
+            self.watched_synced[userid] = time.time()
+
+    def start_sync(self, interval, resync):
+        """
+            Sync every `interval` seconds, or sooner after `request_sync`,
+            with a full sync when none has run for `resync` seconds
+        """
+        def run():
+            while True:
+                try:
+                    resynced = self.get_meta('resynced')
+                    self.sync(resynced is None or time.time() - float(resynced) > resync)
+                except:
+                    self.failures += 1
+                    traceback.print_exc(file=sys.stderr)
+                self._wake.wait(interval)
+                self._wake.clear()
+        t = threading.Thread(target=run, name='mirror-sync')
+        t.daemon = True
+        t.start()
+
+    def request_sync(self):
+        """
+            Sync now after a write; reads skip the mirror until then
+        """
+        self.written = time.time()
+        self._wake.set()
+
+    def find(self, status=None, assigned_to=None, unassigned=False, author=None, \
+             projects=None, updated_from=None, updated_to=None, watcher=None, \
+             ids=None, order='priority', limit=None, offset=None):
+        """
+            Issues matching every given filter as (raw issues, total count);
+            `watcher` limits them to that user's last `sync_watched` result;
+            `status` takes Redmine's 'open', 'closed', '*' or status IDs
+            joined with '|'
+            and `updated_from`/`updated_to` are UTC timestamps
+        """
+        if ids is not None and len(ids) > SQL_IN_CHUNK:
+            return self.find_chunked(status, assigned_to, unassigned, author, projects, \
+                                     updated_from, updated_to, watcher, ids, order, limit, offset)
+        where = []
+        params = []
+        if status in (None, 'open'):
+            where.append("status_id NOT IN (SELECT id FROM statuses WHERE is_closed = 1)")
+        elif status == 'closed':
+            where.append("status_id IN (SELECT id FROM statuses WHERE is_closed = 1)")
+        elif status != '*':
+            statuses = [int(s) for s in str(status).split('|')]
+            where.append("status_id IN (" + ", ".join("?" * len(statuses)) + ")")
+            params.extend(statuses)
+        if assigned_to is not None:
+            where.append("assigned_to_id = ?")
+            params.append(int(assigned_to))
+        if unassigned:
+            where.append("assigned_to_id IS NULL")
+        if author is not None:
+            where.append("author_id = ?")
+            params.append(int(author))
+        if projects is not None:
+            where.append("project_id IN ("+",".join("?" * len(projects))+")")
+            params.extend(int(p) for p in projects)
+        if updated_from is not None:
+            where.append("updated_on >= ?")
+            params.append(updated_from)
+        if updated_to is not None:
+            where.append("updated_on < ?")
+            params.append(updated_to)
+        if watcher is not None:
+            where.append("id IN (SELECT issue_id FROM watched WHERE user_id = ?)")
+            params.append(int(watcher))
+        if ids is not None:
+            where.append("id IN ("+",".join("?" * len(ids))+")")
+            params.extend(int(i) for i in ids)
+        sql = " FROM issues"
+        if where:
+            sql += " WHERE "+" AND ".join(where)
+        if order == 'created':
+            order_by = " ORDER BY created_on, id"
+        else:
+            # Redmine breaks ties in its sort by newest issue first
+            order_by = " ORDER BY priority_id DESC, id DESC"
+        page = ""
+        if limit:
+            page = " LIMIT "+str(int(limit))+" OFFSET "+str(int(offset or 0))
+        with self._lock:
+            rows = self._conn.execute("SELECT raw"+sql+order_by+page, params).fetchall()
+            if limit:
+                total = self._conn.execute("SELECT COUNT(*)"+sql, params).fetchone()[0]
+            else:
+                total = len(rows)
+        return ([json.loads(row[0]) for row in rows], total)
+
+    def find_chunked(self, status, assigned_to, unassigned, author, projects, updated_from, \
+                     updated_to, watcher, ids, order, limit, offset):
+        """
+            `find` for more IDs than one `IN (...)` clause takes: each chunk
+            is queried whole, then merged, sorted and paged here
+        """
+        issues = []
+        for i in range(0, len(ids), SQL_IN_CHUNK):
+            issues.extend(self.find(status, assigned_to, unassigned, author, projects, \
+                                    updated_from, updated_to, watcher, ids[i:i+SQL_IN_CHUNK], order)[0])
+        if order == 'created':
+            issues.sort(key=lambda raw: (raw['created_on'], raw['id']))
+        else:
+            issues.sort(key=lambda raw: (raw['priority']['id'], raw['id']), reverse=True)
+        total = len(issues)
+        if limit:
+            issues = issues[int(offset or 0):int(offset or 0)+int(limit)]
+        return (issues, total)
+
+    def spent_hours(self, issueids):
+        """
+            Map of issue ID to hours logged against it, 0.0 when none
+        """
+        issueids = sorted(set(int(i) for i in issueids))
+        results = dict.fromkeys(issueids, 0.0)
+        with self._lock:
+            for i in range(0, len(issueids), SQL_IN_CHUNK):
+                chunk = issueids[i:i+SQL_IN_CHUNK]
+                for (issue_id, hours) in self._conn.execute( \
+                        "SELECT issue_id, SUM(hours) FROM time_entries WHERE issue_id IN (" \
+                        +",".join("?" * len(chunk))+") GROUP BY issue_id", chunk):
+                    results[issue_id] = hours
+        return results
+
+    def user_hours(self, userid, fromdate):
+        """
+            Map of issue ID to hours the user logged on or after `fromdate`
+        """
+        with self._lock:
+            return dict(self._conn.execute( \
+                "SELECT issue_id, SUM(hours) FROM time_entries WHERE user_id = ? " \
+                "AND spent_on >= ? GROUP BY issue_id", (int(userid), str(fromdate))).fetchall())
+
+    def stats(self):
+        with self._lock:
+            counts = dict((table, self._conn.execute("SELECT COUNT(*) FROM "+table).fetchone()[0]) \
+                          for table in ('issues', 'watched', 'time_entries'))
+        counts.update({
+            'syncs': self.syncs,
+            'failures': self.failures,
+            'synced': self.synced,
+            'watermark': self.get_meta('watermark')
+        })
+        return counts
@@ -1,5 +1,6 @@
 import os
 from slackclient import SlackClient
+from slack_directory import load_slack_users
 
 
 BOT_NAME = 'redminebot'
@@ -8,12 +9,15 @@ slack_client = SlackClient(os.environ.get('BOT_TOKEN'))
 
 
 if __name__ == "__main__":
-    api_call = slack_client.api_call("users.list")
-    if api_call.get('ok'):
+    try:
         # retrieve all users so we can find our bot
-        users = api_call.get('members')
-        for user in users:
-            if 'name' in user and user.get('name') == BOT_NAME:
-                print("Bot ID for '" + user['name'] + "' is " + user.get('id'))
-    else:
+        users = load_slack_users(slack_client)
+    except RuntimeError:
+        users = []
+    found = False
+    for user in users:
+        if 'name' in user and user.get('name') == BOT_NAME:
+            print("Bot ID for '" + user['name'] + "' is " + user.get('id'))
+            found = True
+    if not found:
         print("could not find bot user with the name " + BOT_NAME)
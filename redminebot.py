@@ -3,10 +3,23 @@ import time
 import re
 import sys
 import traceback
+import select
+import threading
+import cProfile
+import pstats
 from datetime import datetime
 from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+import requests
 from slackclient import SlackClient
 from redminelib import Redmine
+from redminelib.engines import SyncEngine
+from cache import LRUCache
+from slack_directory import SlackDirectory
+from executor import CommandExecutor
+from mirror import IssueMirror, MirrorResult
+from metrics import MetricsRegistry, start_metrics_server
+from tracing import Tracer
 
 """
     Load environment variables
@@ -29,11 +42,42 @@ REDMINE_TRACKER_ID = os.environ.get('REDMINE_TRACKER_ID')
 REDMINE_WATCHED_QUERY_ID = os.environ.get('REDMINE_WATCHED_QUERY_ID')
 BOT_ID = os.environ.get('BOT_ID')
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', '3600'))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '512'))
+NAME_CACHE_SIZE = int(os.environ.get('NAME_CACHE_SIZE', '1024'))
+REDMINE_CONNECTIONS = int(os.environ.get('REDMINE_CONNECTIONS', '10'))
+REDMINE_CLIENT_POOL_SIZE = int(os.environ.get('REDMINE_CLIENT_POOL_SIZE', '64'))
+BOT_WORKERS = int(os.environ.get('BOT_WORKERS', '0'))
+BOT_QUEUE_DEPTH = int(os.environ.get('BOT_QUEUE_DEPTH', '100'))
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', '4'))
+BOT_USER_QUEUE_DEPTH = int(os.environ.get('BOT_USER_QUEUE_DEPTH', '10'))
+BOT_CLASS_WEIGHTS = os.environ.get('BOT_CLASS_WEIGHTS', 'cheap=8,normal=3,expensive=1')
+BOT_EXPENSIVE_WORKERS = int(os.environ.get('BOT_EXPENSIVE_WORKERS') or max(1, BOT_WORKERS // 2))
+RTM_READ_MODE = os.environ.get('RTM_READ_MODE', 'poll')
+RTM_READ_TIMEOUT = float(os.environ.get('RTM_READ_TIMEOUT', '1.0'))
+PROJECT_INDEX_TTL = int(os.environ.get('PROJECT_INDEX_TTL', '900'))
+ISSUE_LINE_CACHE_SIZE = int(os.environ.get('ISSUE_LINE_CACHE_SIZE', '4096'))
+LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', '25'))
+LIST_CURSOR_TTL = int(os.environ.get('LIST_CURSOR_TTL', '900'))
+CATALOG_REFRESH = int(os.environ.get('CATALOG_REFRESH', '3600'))
+REDMINE_MIRROR_PATH = os.environ.get('REDMINE_MIRROR_PATH')
+MIRROR_SYNC_INTERVAL = int(os.environ.get('MIRROR_SYNC_INTERVAL', '60'))
+MIRROR_RESYNC_INTERVAL = int(os.environ.get('MIRROR_RESYNC_INTERVAL', '21600'))
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '0'))
+METRICS_ADDRESS = os.environ.get('METRICS_ADDRESS', '')
+BOT_ADMINS = [a.strip() for a in os.environ.get('BOT_ADMINS', '').split(',') if a.strip()]
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '')
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', '15'))
+TRACE_SLOW_MS = os.environ.get('TRACE_SLOW_MS', '')
+TRACE_LOG = os.environ.get('TRACE_LOG', '')
+BOT_DEBUG = os.environ.get('BOT_DEBUG', '') not in ('', '0')
 
 """
     CONSTANTS
 """
 AT_BOT = "<@" + BOT_ID + ">"
+# Max issue IDs per bulk `issue_id=1,2,3` filter to stay within URL limits
+ISSUE_ID_CHUNK = 100
 STATUSES = {
     'new': (REDMINE_NEW_ID, "New"),
     'in': (REDMINE_INPROGRESS_ID, "In Progress"),
@@ -56,6 +100,25 @@ STATUS_NAME_LOOKUP = {
 SCRUM_ORDER = [REDMINE_INPROGRESS_ID, REDMINE_FEEDBACK_ID, \
               REDMINE_RESOLVED_ID, REDMINE_NEW_ID, REDMINE_HOLD_ID]
 EOD_ORDER = [REDMINE_CLOSED_ID, REDMINE_REJECTED_ID]
+# Command verbs understood by handle_command, used to label metrics
+COMMAND_OPERATORS = set(['issue', 'issueto', 'issuep', 'issuepto', 'issuepv', \
+    'issuepvto', 'assign', 'update', 'status', 'close', 'reject', 'rank', \
+    'list', 'listall', 'listun', 'listfor', 'more', 'scrum', 'scrumfor', 'eod', \
+    'eodfor', 'eow', 'eowfor', 't5', 't5for', 't5add', 't5rank', 'help', 'sum', \
+    'wadd', 'wdel', 'profile'])
+
+# Cost class of each operator for scheduling on the worker pool; anything
+# not listed here is 'normal'
+COMMAND_COSTS = {
+    'link': 'cheap', 'help': 'cheap', 'more': 'cheap', 'update': 'cheap',
+    'assign': 'cheap', 'status': 'cheap', 'close': 'cheap', 'reject': 'cheap',
+    'rank': 'cheap', 't5add': 'cheap', 't5rank': 'cheap', 'wadd': 'cheap',
+    'wdel': 'cheap', 'issue': 'cheap', 'issueto': 'cheap', 'issuep': 'cheap',
+    'issuepto': 'cheap', 'issuepv': 'cheap', 'issuepvto': 'cheap',
+    'listall': 'expensive', 'sum': 'expensive', 'eod': 'expensive',
+    'eodfor': 'expensive', 'eow': 'expensive', 'eowfor': 'expensive',
+    'profile': 'expensive'
+}
 
 """
     CONSTANT regexps
@@ -66,11 +129,448 @@ PERCENT_RE = re.compile(r"[%]([0-9]{1,3})")
 HTTP_RE = re.compile(r"(\<(https?:\/\/[^\|]*)\|([^\>]*)\>)")
 SLACK_USER_RE = re.compile(r"[<][@]([A-z0-9]*)[>]")
 
+"""
+    Metrics
+"""
+# Always collected; served for Prometheus only when METRICS_PORT is set
+METRICS = MetricsRegistry()
+COMMAND_SECONDS = METRICS.histogram('redminebot_command_duration_seconds', \
+    "Time to run and answer a command", ['operator'])
+REDMINE_SECONDS = METRICS.histogram('redminebot_redmine_request_duration_seconds', \
+    "Redmine API request latency", ['method', 'endpoint'])
+REDMINE_ERRORS = METRICS.counter('redminebot_redmine_errors_total', \
+    "Redmine API requests that failed", ['method', 'endpoint'])
+SLACK_SECONDS = METRICS.histogram('redminebot_slack_request_duration_seconds', \
+    "Slack Web API call latency", ['method'])
+SLACK_ERRORS = METRICS.counter('redminebot_slack_errors_total', \
+    "Slack Web API calls that were not ok", ['method'])
+RTM_LAG_SECONDS = METRICS.histogram('redminebot_rtm_lag_seconds', \
+    "Time from a message being posted to the bot dispatching it")
+QUEUE_WAIT_SECONDS = METRICS.histogram('redminebot_queue_wait_seconds', \
+    "Time a command waited for a worker", ['cost'])
+
+"""
+    Tracing
+"""
+# Span trees of commands slower than TRACE_SLOW_MS are written as JSON
+# lines to TRACE_LOG, or stderr; nothing is traced when it is not set
+TRACER = Tracer()
+if TRACE_SLOW_MS != '':
+    TRACER = Tracer(float(TRACE_SLOW_MS), open(TRACE_LOG, 'a') if TRACE_LOG else None)
+
+"""
+    Redmine connection pooling
+"""
+# One keep-alive HTTP session shared by the bot client and every
+# impersonated client
+REDMINE_SESSION = requests.Session()
+REDMINE_SESSION.mount('http://', requests.adapters.HTTPAdapter(
+    pool_connections=REDMINE_CONNECTIONS, pool_maxsize=REDMINE_CONNECTIONS))
+REDMINE_SESSION.mount('https://', requests.adapters.HTTPAdapter(
+    pool_connections=REDMINE_CONNECTIONS, pool_maxsize=REDMINE_CONNECTIONS))
+
+# Redmine requests made by the current thread, for per-command debug output
+REDMINE_CALLS = threading.local()
+
+def rm_call_count():
+    return getattr(REDMINE_CALLS, 'count', 0)
+
+class PooledEngine(SyncEngine):
+    """
+        python-redmine engine that sends every request through the shared
+        REDMINE_SESSION; the API key and `X-Redmine-Switch-User` headers of
+        each client are added per request instead of stored on the session
+    """
+    @staticmethod
+    def create_session(**params):
+        return REDMINE_SESSION
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        REDMINE_CALLS.count = rm_call_count() + 1
+        kwargs = self.construct_request_kwargs(method, \
+                    dict(self.requests['headers'], **(headers or {})), \
+                    dict(self.requests['params'], **(params or {})), data)
+        for option in self.requests:
+            if option not in ('headers', 'params'):
+                kwargs[option] = self.requests[option]
+        labels = (method.upper(), redmine_endpoint(url))
+        start = time.time()
+        with TRACER.span('redmine', method=labels[0], endpoint=labels[1]):
+            try:
+                return self.process_response(self.session.request(method, url, **kwargs))
+            except:
+                REDMINE_ERRORS.inc(labels)
+                raise
+            finally:
+                REDMINE_SECONDS.observe(labels, time.time() - start)
+
+def redmine_endpoint(url):
+    """
+        Request path with IDs replaced, e.g. `/issues/:id.json`, so
+        metrics have one series per endpoint rather than per issue
+    """
+    path = re.sub(r'^[a-z]+://[^/]+', '', url.split('?')[0])
+    if REDMINE_HOST:
+        path = path.replace(re.sub(r'^[a-z]+://[^/]+', '', REDMINE_HOST.rstrip('/')), '', 1)
+    path = re.sub(r'^/projects/[^/.]+', '/projects/:id', path)
+    return re.sub(r'/\d+', '/:id', path)
+
+# Slack Web API calls made by the current thread, like REDMINE_CALLS
+SLACK_CALLS = threading.local()
+
+def sc_call_count():
+    return getattr(SLACK_CALLS, 'count', 0)
+
+class InstrumentedSlackClient(SlackClient):
+    """
+        SlackClient that records latency and failures of Web API calls
+    """
+    def api_call(self, method, *args, **kwargs):
+        SLACK_CALLS.count = sc_call_count() + 1
+        start = time.time()
+        with TRACER.span('slack', method=method):
+            try:
+                result = SlackClient.api_call(self, method, *args, **kwargs)
+            except:
+                SLACK_ERRORS.inc((method,))
+                raise
+            finally:
+                SLACK_SECONDS.observe((method,), time.time() - start)
+        if isinstance(result, dict) and not result.get('ok'):
+            SLACK_ERRORS.inc((method,))
+        return result
+
+class RedmineClientPool(object):
+    """
+        Impersonated Redmine clients kept per login with LRU eviction
+    """
+    def __init__(self, maxsize):
+        self.clients = LRUCache('redmine_client', maxsize=maxsize)
+
+    def get(self, userlogin):
+        rcn = self.clients.get(userlogin)
+        if rcn is None:
+            rcn = Redmine(REDMINE_HOST, version=REDMINE_VERSION, key=REDMINE_TOKEN, \
+                          impersonate=userlogin, engine=PooledEngine)
+            self.clients.put(userlogin, rcn)
+        return rcn
+
+    def stats(self):
+        stats = self.clients.stats()
+        stats['reuse_rate'] = stats['hit_rate']
+        return stats
+
 """
     Instantiate Slack & Redmine clients
 """
-sc = SlackClient(BOT_TOKEN)
-rc = Redmine(REDMINE_HOST, version=REDMINE_VERSION, key=REDMINE_TOKEN)
+sc = InstrumentedSlackClient(BOT_TOKEN)
+rc = Redmine(REDMINE_HOST, version=REDMINE_VERSION, key=REDMINE_TOKEN, engine=PooledEngine)
+RC_POOL = RedmineClientPool(REDMINE_CLIENT_POOL_SIZE)
+
+"""
+    Redmine catalog
+"""
+class RedmineCatalog(object):
+    """
+        Issue statuses, priorities, trackers, time entry activities and
+        issue queries, loaded in parallel and indexed by ID and by
+        lower-cased name so lookups need no Redmine calls
+    """
+    def __init__(self, loaders):
+        self.loaders = loaders
+        self.by_id = {}
+        self.by_name = {}
+        self.loaded = None
+
+    def load(self):
+        results = {}
+        def fetch(kind):
+            try:
+                results[kind] = [(str(r.id), r.name) for r in self.loaders[kind]()]
+            except:
+                traceback.print_exc(file=sys.stderr)
+        threads = [threading.Thread(target=fetch, args=(kind,)) for kind in self.loaders]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # swap in whole indexes so readers never see a partial catalog;
+        # kinds that failed to load keep their previous contents
+        by_id = dict(self.by_id)
+        by_name = dict(self.by_name)
+        for kind in results:
+            by_id[kind] = dict(results[kind])
+            by_name[kind] = dict((name.lower(), id) for (id, name) in results[kind])
+        self.by_id = by_id
+        self.by_name = by_name
+        self.loaded = datetime.now()
+        return sorted(results.keys())
+
+    def start_refresh(self, interval):
+        def refresh():
+            while True:
+                time.sleep(interval)
+                self.load()
+                invalidate_name_caches()
+        t = threading.Thread(target=refresh, name='catalog-refresh')
+        t.daemon = True
+        t.start()
+
+    def name(self, kind, id):
+        return self.by_id.get(kind, {}).get(str(id))
+
+    def id(self, kind, name):
+        return self.by_name.get(kind, {}).get(name.lower())
+
+CATALOG = RedmineCatalog({
+    'statuses': lambda: rc.issue_status.all(),
+    'priorities': lambda: rc.enumeration.filter(resource='issue_priorities'),
+    'trackers': lambda: rc.tracker.all(),
+    'activities': lambda: rc.enumeration.filter(resource='time_entry_activities'),
+    'queries': lambda: rc.query.all()
+})
+
+"""
+    Project & version index
+"""
+class ProjectIndex(object):
+    """
+        Projects keyed by lower-cased identifier and ID, each with its
+        versions keyed by lower-cased name
+
+        All projects are loaded in bulk on first use. After that only the
+        piece that missed or went stale is reloaded: a single project, or
+        the versions of one project. Projects are looked up by exact ID or
+        identifier; unique prefixes of version names are accepted and
+        remembered, so repeat lookups are a single dictionary hit.
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.projects = {}
+        self.versions = {}
+        self.loaded = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        projects = {}
+        for p in rc.project.all():
+            projects[p.identifier.lower()] = p
+            projects[str(p.id)] = p
+        with self._lock:
+            self.projects = projects
+            self.versions = {}
+            self.loaded = time.time()
+
+    def expired(self, loaded):
+        return loaded is None or time.time() - loaded > self.ttl
+
+    def project(self, name):
+        if self.expired(self.loaded):
+            self.load()
+        key = str(name).lower()
+        if key not in self.projects:
+            # created since the bulk load, or not listed (e.g. archived);
+            # fetch just this one
+            project = rc.project.get(name)
+            with self._lock:
+                self.projects[key] = project
+                self.projects[project.identifier.lower()] = project
+                self.projects[str(project.id)] = project
+        return self.projects[key]
+
+    def version(self, project, name):
+        key = project.identifier.lower()
+        entry = self.versions.get(key)
+        if entry is None or self.expired(entry[0]) or name.lower() not in entry[1]:
+            if entry is None or self.expired(entry[0]) \
+              or self.match_prefix(entry[1], name.lower()) is None:
+                entry = (time.time(), dict((v.name.lower(), v) for v in \
+                                           rc.version.filter(project_id=project.identifier)))
+            version = self.match_prefix(entry[1], name.lower())
+            if version is not None:
+                entry[1][name.lower()] = version
+            with self._lock:
+                self.versions[key] = entry
+        return entry[1].get(name.lower())
+
+    def subprojects(self, project):
+        """
+            IDs of the project and all its descendants, matching what
+            Redmine's `project_id` filter includes
+        """
+        self.project(project.identifier)
+        ids = set([project.id])
+        children = {}
+        for p in set(self.projects.values()):
+            parent = p.raw().get('parent')
+            if parent:
+                children.setdefault(parent['id'], []).append(p.id)
+        pending = [project.id]
+        while pending:
+            for child in children.get(pending.pop(), []):
+                if child not in ids:
+                    ids.add(child)
+                    pending.append(child)
+        return sorted(ids)
+
+    @staticmethod
+    def match_prefix(index, key):
+        """
+            Exact key, or the single distinct entry whose key starts with it
+        """
+        if key in index:
+            return index[key]
+        matches = set(id(v) for (k, v) in index.items() if k.startswith(key))
+        if len(matches) == 1:
+            for (k, v) in index.items():
+                if k.startswith(key):
+                    return v
+        return None
+
+PROJECT_INDEX = ProjectIndex(PROJECT_INDEX_TTL)
+
+"""
+    Redmine mirror
+"""
+# Read-only commands are answered from a local SQLite copy of Redmine
+# when REDMINE_MIRROR_PATH is set, once it has synced in this process and
+# while no change the bot made is waiting to be synced
+MIRROR = None
+if REDMINE_MIRROR_PATH:
+    MIRROR = IssueMirror(REDMINE_MIRROR_PATH, rc)
+# Commands that change Redmine and should be synced without waiting
+MIRROR_WRITE_OPERATORS = set(['issue', 'issueto', 'issuep', 'issuepto', 'issuepv', \
+    'issuepvto', 'assign', 'update', 'status', 'close', 'reject', 'rank', \
+    't5add', 't5rank', 'wadd', 'wdel'])
+
+def mirror_ready():
+    return MIRROR is not None and MIRROR.ready()
+
+def mirror_issues(project=None, **filters):
+    if project:
+        filters['projects'] = PROJECT_INDEX.subprojects(rm_get_project(project))
+    issues, total = MIRROR.find(**filters)
+    return MirrorResult([rc.issue.to_resource(raw) for raw in issues], total)
+
+def mirror_updated_between(first, last):
+    """
+        UTC bounds of the local days `first` through `last`
+    """
+    start = local2utc(datetime.combine(first, datetime.min.time()))
+    end = local2utc(datetime.combine(last + timedelta(days=1), datetime.min.time()))
+    return (start.strftime('%Y-%m-%dT%H:%M:%SZ'), end.strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+"""
+    Command execution
+"""
+def command_classes(weights, expensive_workers):
+    """
+        Executor cost classes from `cheap=8,normal=3,expensive=1`; the
+        expensive class may only occupy `expensive_workers` workers and
+        classes left out get a weight of 1
+    """
+    weights = dict((name.strip(), int(weight)) for (name, weight) in \
+                   (item.split('=') for item in weights.split(',') if item.strip()))
+    return [(name, weights.get(name, 1), expensive_workers if name == 'expensive' else None) \
+            for name in ('cheap', 'normal', 'expensive')]
+
+# Commands run inline in the RTM loop unless BOT_WORKERS is set; with
+# workers, a user's commands of one cost class in a channel still run (and
+# reply) in order, while a cheap command never waits behind an expensive one
+EXECUTOR = None
+if BOT_WORKERS > 0:
+    EXECUTOR = CommandExecutor(workers=BOT_WORKERS, max_queue=BOT_QUEUE_DEPTH, \
+        classes=command_classes(BOT_CLASS_WEIGHTS, BOT_EXPENSIVE_WORKERS), \
+        max_per_user=BOT_USER_QUEUE_DEPTH, \
+        on_start=lambda cost, wait: QUEUE_WAIT_SECONDS.observe((cost,), wait))
+
+# Threads shared by all reports for their independent Redmine queries;
+# pool tasks never wait on the pool themselves, so they cannot deadlock
+REPORT_POOL = None
+if REPORT_WORKERS > 0:
+    REPORT_POOL = ThreadPool(REPORT_WORKERS)
+
+# Set while `profile` runs a command: cProfile only sees its own thread,
+# so report queries then run inline
+PROFILING = threading.local()
+
+def run_report_call(call, parent):
+    if parent is not None:
+        TRACER.push(parent)
+    redmine_calls = rm_call_count()
+    slack_calls = sc_call_count()
+    try:
+        result = call[0](*call[1:])
+        if hasattr(result, '__len__'):
+            # result sets are lazy; fetch them here, not on the caller
+            len(result)
+        return (result, rm_call_count() - redmine_calls, sc_call_count() - slack_calls)
+    finally:
+        if parent is not None:
+            TRACER.pop(parent)
+
+class ReportTask(object):
+    """
+        `(function, args...)` call started on the report pool, or run right
+        away when there is no pool or the command is profiled. `get` waits
+        for the result; the call joins the caller's trace and its Redmine
+        and Slack calls count towards the thread that gets it.
+    """
+    def __init__(self, *call):
+        self.pending = None
+        if REPORT_POOL is None or getattr(PROFILING, 'active', False):
+            self.result = call[0](*call[1:])
+        else:
+            self.pending = REPORT_POOL.apply_async(run_report_call, (call, TRACER.current()))
+
+    def get(self):
+        if self.pending is not None:
+            (self.result, redmine_calls, slack_calls) = self.pending.get()
+            self.pending = None
+            REDMINE_CALLS.count = rm_call_count() + redmine_calls
+            SLACK_CALLS.count = sc_call_count() + slack_calls
+        return self.result
+
+"""
+    Caches
+"""
+# Slack user ID --> Redmine username, invalidated on RTM `user_change`
+USER_CACHE = LRUCache('slack_user', maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# Slack workspace members by user ID, loaded at startup and kept current
+# from RTM `team_join`/`user_change` events
+SLACK_DIRECTORY = SlackDirectory()
+# Redmine ID --> display name for users, projects and statuses; cleared by
+# invalidate_name_caches() on every catalog refresh
+USER_NAME_CACHE = LRUCache('user_name', maxsize=NAME_CACHE_SIZE)
+PROJECT_NAME_CACHE = LRUCache('project_name', maxsize=NAME_CACHE_SIZE)
+STATUS_NAME_CACHE = LRUCache('status_name', maxsize=NAME_CACHE_SIZE)
+NAME_CACHES = [USER_NAME_CACHE, PROJECT_NAME_CACHE, STATUS_NAME_CACHE]
+# (issue ID, updated_on) --> formatted fragments of the issue's report line
+ISSUE_LINE_CACHE = LRUCache('issue_line', maxsize=ISSUE_LINE_CACHE_SIZE)
+# (channel, Slack user) --> listing being paged through with `more`
+LIST_CURSORS = LRUCache('list_cursor', maxsize=256, ttl=LIST_CURSOR_TTL)
+
+def cache_stats():
+    caches = [USER_CACHE] + NAME_CACHES + [ISSUE_LINE_CACHE, LIST_CURSORS, RC_POOL.clients]
+    return [c.stats() for c in caches]
+
+METRICS.gauge('redminebot_cache_hit_ratio', "Share of cache lookups that hit", ['cache'], \
+    lambda: [((c['name'],), c['hit_rate']) for c in cache_stats()])
+METRICS.collected_counter('redminebot_cache_lookups_total', "Cache lookups by result", ['cache', 'result'], \
+    lambda: [((c['name'], r), c[k]) for c in cache_stats() \
+             for (r, k) in (('hit', 'hits'), ('miss', 'misses'))])
+METRICS.gauge('redminebot_cache_entries', "Entries held in each cache", ['cache'], \
+    lambda: [((c['name'],), c['size']) for c in cache_stats()])
+METRICS.gauge('redminebot_queue_depth', "Commands waiting for a worker", (), \
+    lambda: [((), EXECUTOR.depth if EXECUTOR is not None else 0)])
+METRICS.collected_counter('redminebot_commands_rejected_total', \
+    "Commands turned away because the queue was full", (), \
+    lambda: [((), EXECUTOR.rejected if EXECUTOR is not None else 0)])
+METRICS.gauge('redminebot_class_queue_depth', "Commands waiting for a worker by cost class", ['cost'], \
+    lambda: [((name,), c['queued']) for (name, c) in sorted(EXECUTOR.stats().items())] \
+            if EXECUTOR is not None else [])
+METRICS.gauge('redminebot_rtm_loop_age_seconds', "Seconds since the RTM loop last read from Slack", (), \
+    lambda: [((), time.time() - RTM_STATS['last_read'])] if RTM_STATS['last_read'] else [])
 
 """
     Slack command parser
@@ -83,6 +583,8 @@ def handle_command(command, channel, user, username):
     """
     response = ":question: Unknown/invalid command - Try `help` for a list of supported commands"
     commands = command.split(' ')
+    # long reports post their header first and fill in as they go
+    reply = ProgressiveReply(channel, user)
     try:
         if commands:
             operator = commands[0].lower()
@@ -151,41 +653,43 @@ def handle_command(command, channel, user, username):
                     project = commands[1]
                 else:
                     project = None
-                response = cmd_list_issues(username, project)
+                response = cmd_list_issues(username, project, (channel, user))
             elif operator == "listall":
                 if len(commands) > 1:
                     project = commands[1]
                 else:
                     project = None
-                response = cmd_list_all_issues(project)
+                response = cmd_list_all_issues(project, (channel, user), reply)
             elif operator == "listun":
                 if len(commands) > 1:
                     project = commands[1]
                 else:
                     project = None
-                response = cmd_list_unassigned_issues(project)
+                response = cmd_list_unassigned_issues(project, (channel, user))
             elif operator == "listfor" and len(commands) > 1:
                 listuser = commands[1]
                 if len(commands) > 2:
                     project = commands[2]
                 else:
                     project = None
-                response = cmd_list_issues(listuser, project)
+                response = cmd_list_issues(listuser, project, (channel, user))
+            elif operator == "more":
+                response = cmd_list_more((channel, user))
             elif operator == "scrum":
-                response = cmd_daily_scrum(username)
+                response = cmd_daily_scrum(username, reply)
             elif operator == "scrumfor" and len(commands) > 1:
                 listuser = commands[1]
-                response = cmd_daily_scrum(listuser)
+                response = cmd_daily_scrum(listuser, reply)
             elif operator == "eod":
-                response = cmd_daily_eod(username)
+                response = cmd_daily_eod(username, reply)
             elif operator == "eodfor" and len(commands) > 1:
                 listuser = commands[1]
-                response = cmd_daily_eod(listuser)
+                response = cmd_daily_eod(listuser, reply)
             elif operator == "eow":
-                response = cmd_weekly_eow(username)
+                response = cmd_weekly_eow(username, reply)
             elif operator == "eowfor" and len(commands) > 1:
                 listuser = commands[1]
-                response = cmd_weekly_eow(listuser)
+                response = cmd_weekly_eow(listuser, reply)
             elif operator == "t5":
                 response = cmd_list_top5(username)
             elif operator == "t5for" and len(commands) > 1:
@@ -221,65 +725,159 @@ def handle_command(command, channel, user, username):
                 else:
                     msg = ""
                 response = cmd_watcher_delete(msg, issue, username, watcher)
+            elif operator == "profile" and len(commands) > 1:
+                response = cmd_profile(s.join(commands[1:]), channel, user, username)
             elif int(commands[0]) > 0:
                 issue = int(commands[0])
                 response = cmd_link_issue(issue)
     except ValueError:
         respone = show_commands()
     except RuntimeError as e:
-        response = e[0]
-    message = "<@" + user + "> " + response
-    sc.api_call("chat.postMessage", channel=channel, \
-                          text=message, as_user=True)
+        response = e.args[0]
+    if MIRROR is not None and commands[0].lower() in MIRROR_WRITE_OPERATORS:
+        MIRROR.request_sync()
+    reply.finish(response)
+
+class ProgressiveReply(object):
+    """
+        Reply to a command that can be posted early and then grown in place
+        with chat.update, so long reports show each section as it is ready
+    """
+    def __init__(self, channel, user):
+        self.channel = channel
+        self.prefix = "<@" + user + "> "
+        self.ts = None
+        self.posted = None
+
+    def post(self, text):
+        message = self.prefix + text
+        if message == self.posted:
+            return
+        self.posted = message
+        if self.ts is None:
+            result = sc.api_call("chat.postMessage", channel=self.channel, \
+                                 text=message, as_user=True)
+            if result and result.get('ok'):
+                # chat.update needs the channel ID Slack resolved the post to
+                self.channel = result.get('channel', self.channel)
+                self.ts = result.get('ts')
+        else:
+            sc.api_call("chat.update", channel=self.channel, ts=self.ts, \
+                        text=message, as_user=True)
+
+    def progress(self, text):
+        self.post(text + ":hourglass_flowing_sand: _Loading..._\n")
+
+    def finish(self, text):
+        self.post(text)
+
+def report_progress(reply, response):
+    if reply is not None:
+        reply.progress(response)
+
+def run_command(command, channel, user, ts=None):
+    """
+        Resolve the sender's Redmine username and run the command; runs on
+        a worker when there is a pool, since the lookup may call Slack and
+        Redmine
+    """
+    start = time.time()
+    try:
+        username = resolve_slack_user(user)
+    except RuntimeError as e:
+        message = "<@" + str(user) + "> " + str(e.args[0])
+        sc.api_call("chat.postMessage", channel=channel, \
+                              text=message, as_user=True)
+        return
+    if not username:
+        command = "help"
+    operator = command_operator(command)
+    with TRACER.trace('command', operator=operator, channel=channel, user=username):
+        handle_command(command, channel, user, username)
+    COMMAND_SECONDS.observe((operator,), time.time() - start)
+    if ts:
+        # Slack `ts` is the epoch time the message was posted
+        debug("replied to `"+command+"` in "+channel+" after " \
+              +"%.3fs" % (time.time() - float(ts)))
+
+def dispatch_command(command, channel, user, ts=None):
+    """
+        Run the command inline, or hand it to the worker pool when one is
+        configured so the RTM reader never waits on Redmine
+    """
+    if ts:
+        RTM_LAG_SECONDS.observe((), max(0.0, time.time() - float(ts)))
+    cost = command_cost(command)
+    if EXECUTOR is None:
+        run_command(command, channel, user, ts)
+    elif not EXECUTOR.submit((channel, user, cost), run_command, \
+                             (command, channel, user, ts), cost, user):
+        message = "<@" + user + "> :hourglass: Busy with other requests, please try again shortly"
+        sc.api_call("chat.postMessage", channel=channel, \
+                              text=message, as_user=True)
 
 def parse_slack_output(slack_rtm_output):
     """
         The Slack Real Time Messaging API is an events firehose.
-        this parsing function returns None unless a message is
-        directed at the Bot, based on its ID.
+        this parsing function yields one (command, channel, user, ts)
+        tuple for every message in the batch that is directed at the Bot,
+        based on its ID. Users are resolved later, by `run_command`.
     """
     output_list = slack_rtm_output
     if output_list and len(output_list) > 0:
         for output in output_list:
-            if output and 'text' in output and AT_BOT in output['text']:
-                try:
-                    user = output['user']
-                    username = ''
-                    name = ''
-                    profile = sc.api_call("users.info", user=output['user'])
-                    # username used for searching in redmine; try last/first,
-                    # then last, first, display, username
-
-                    if 'last_name' in profile['user']['profile'] \
-                      and profile['user']['profile']['last_name'] != '' \
-                      and 'first_name' in profile['user']['profile'] \
-                      and profile['user']['profile']['first_name'] != '':
-                        name = profile['user']['profile']['first_name'] + \
-                                   " " + profile['user']['profile']['last_name']
-                        username = rm_check_username(name)
-                    if username == '' and 'last_name' in profile['user']['profile'] \
-                      and profile['user']['profile']['last_name'] != '':
-                        name = profile['user']['profile']['last_name']
-                        username = rm_check_username(name)
-                    if username == '' and 'first_name' in profile['user']['profile'] \
-                      and profile['user']['profile']['first_name'] != '':
-                        name = profile['user']['profile']['first_name']
-                        username = rm_check_username(name)
-                    if username == '' and 'display_name' in profile['user']['profile'] \
-                      and profile['user']['profile']['display_name'] != '':
-                        name = profile['user']['profile']['display_name']
-                        username = rm_check_username(name)
-                    if username == '' and 'name' in profile['user']:
-                        name = profile['user']['name']
-                        username = rm_check_username(name)
-                    # return text after the @ mention, whitespace removed
-                    return output['text'].split(AT_BOT)[1].strip(), \
-                           output['channel'], user, username
-                except:
-                    traceback.print_exc(file=sys.stderr)
-                    raise RuntimeError(":x: Unable to find `"+name \
-                                       +"` in Redmine")
-    return None, None, None, None
+            if output and SLACK_DIRECTORY.handle_event(output):
+                # profile changed; next mention must resolve the name again
+                USER_CACHE.invalidate(output['user']['id'])
+            elif output and 'text' in output and AT_BOT in output['text']:
+                # yield text after the @ mention, whitespace removed
+                yield output['text'].split(AT_BOT)[1].strip(), \
+                      output['channel'], output.get('user'), output.get('ts')
+
+def resolve_slack_user(user):
+    """
+        Map a Slack user ID to a Redmine username, using the cache first
+        and only falling back to Slack/Redmine lookups on a miss
+    """
+    username = USER_CACHE.get(user)
+    if username:
+        return username
+    username = ''
+    name = ''
+    try:
+        profile = lookup_slack_user(user)
+        # username used for searching in redmine; try last/first,
+        # then last, first, display, username
+
+        if 'last_name' in profile['user']['profile'] \
+          and profile['user']['profile']['last_name'] != '' \
+          and 'first_name' in profile['user']['profile'] \
+          and profile['user']['profile']['first_name'] != '':
+            name = profile['user']['profile']['first_name'] + \
+                       " " + profile['user']['profile']['last_name']
+            username = rm_check_username(name)
+        if username == '' and 'last_name' in profile['user']['profile'] \
+          and profile['user']['profile']['last_name'] != '':
+            name = profile['user']['profile']['last_name']
+            username = rm_check_username(name)
+        if username == '' and 'first_name' in profile['user']['profile'] \
+          and profile['user']['profile']['first_name'] != '':
+            name = profile['user']['profile']['first_name']
+            username = rm_check_username(name)
+        if username == '' and 'display_name' in profile['user']['profile'] \
+          and profile['user']['profile']['display_name'] != '':
+            name = profile['user']['profile']['display_name']
+            username = rm_check_username(name)
+        if username == '' and 'name' in profile['user']:
+            name = profile['user']['name']
+            username = rm_check_username(name)
+    except:
+        traceback.print_exc(file=sys.stderr)
+        raise RuntimeError(":x: Unable to find `"+name \
+                           +"` in Redmine")
+    if username != '':
+        USER_CACHE.put(user, username)
+    return username
 
 """
     Slack command handler functions
@@ -315,6 +913,7 @@ def show_commands():
             "> `listfor <name> [project]` - lists all open issues assigned to `<name>`\n" \
             "> `listall [project]` - lists all open issues\n" \
             "> `listun [project]` - lists all open and unassigned issues\n" \
+            "> `more` - shows the next page of your last list\n" \
             "*Scrum & End of Day/Week Commands:*\n" \
             "> `scrum` - generates daily scrum for you\n" \
             "> `scrumfor <name>` - generates daily scrum for `<name>`\n" \
@@ -347,13 +946,14 @@ def cmd_link_issue(issue):
 def cmd_summarize_issue(issue):
     issue = rm_get_issue(issue)
     try:
-        watchers = issue_watchers(issue)
-        response = ":bulb: *Issue Summary:*\n"
-        response += issue_detail(issue, extended=True, user=True, description=True)
-        if watchers != "":
-            response += "*Watchers:*\n> "+watchers+"\n"
-        response += "*Changes:*\n"
-        response += issue_journal_details(issue)
+        with TRACER.span('render', issue=issue.id):
+            watchers = issue_watchers(issue)
+            response = ":bulb: *Issue Summary:*\n"
+            response += issue_detail(issue, extended=True, user=True, description=True)
+            if watchers != "":
+                response += "*Watchers:*\n> "+watchers+"\n"
+            response += "*Changes:*\n"
+            response += issue_journal_details(issue)
         return response
     except:
         traceback.print_exc(file=sys.stderr)
@@ -491,211 +1091,199 @@ def cmd_rank_issue(text, issue, username, rank):
 
 ### List commands
 
-def cmd_list_issues(username, project):
+def cmd_list_issues(username, project, cursor=None):
     user = rm_get_user(username)
     try:
-        result = rm_get_user_issues(user.id, 'open', project)
-        response = ""
-        if len(result) > 0:
-            response = ":book: *Open Issues Assigned to "+user.firstname+" "+user.lastname+":*\n"
-            for issue in result:
-                response += issue_detail(issue, extended=False, user=False)
-        else:
-            response = ":thumbsup_all: No open issues assigned to "+user.firstname+" "+user.lastname
-        return response
+        return list_page(cursor, {
+            'title': ":book: *Open Issues Assigned to "+user.firstname+" "+user.lastname+":*\n",
+            'empty': ":thumbsup_all: No open issues assigned to "+user.firstname+" "+user.lastname,
+            'user': False,
+            'fetch': lambda limit, offset: rm_get_user_issues(user.id, 'open', project, limit=limit, offset=offset)
+        })
     except:
         traceback.print_exc(file=sys.stderr)
         raise RuntimeError(":x: List operation failed")
 
-def cmd_list_all_issues(project):
+def cmd_list_all_issues(project, cursor=None, reply=None):
     try:
-        result = rm_get_all_issues('open', False, project)
-        response = ""
-        if len(result) > 0:
-            response = ":book: *All Open Issues:*\n"
-            for issue in result:
-                response += issue_detail(issue, extended=False, user=True)
-        else:
-            response = ":thumbsup_all: No open issues found"
-        return response
+        report_progress(reply, ":book: *All Open Issues:*\n")
+        return list_page(cursor, {
+            'title': ":book: *All Open Issues:*\n",
+            'empty': ":thumbsup_all: No open issues found",
+            'user': True,
+            'fetch': lambda limit, offset: rm_get_all_issues('open', False, project, limit=limit, offset=offset)
+        })
     except:
         traceback.print_exc(file=sys.stderr)
         raise RuntimeError(":x: List all operation failed")
 
-def cmd_list_unassigned_issues(project):
+def cmd_list_unassigned_issues(project, cursor=None):
     try:
-        result = rm_get_all_issues('open', True, project)
-        response = ""
-        if len(result) > 0:
-            response = ":book: *All Open and Unassigned Issues:*\n"
-            for issue in result:
-                response += issue_detail(issue, extended=False, user=False)
-        else:
-            response = ":thumbsup_all: No open and unassigned issues found"
-        return response
+        return list_page(cursor, {
+            'title': ":book: *All Open and Unassigned Issues:*\n",
+            'empty': ":thumbsup_all: No open and unassigned issues found",
+            'user': False,
+            'fetch': lambda limit, offset: rm_get_all_issues('open', True, project, limit=limit, offset=offset)
+        })
     except:
         traceback.print_exc(file=sys.stderr)
         raise RuntimeError(":x: List unassigned operation failed")
 
+def cmd_list_more(cursor):
+    listing = LIST_CURSORS.get(cursor)
+    if listing is None:
+        return ":x: Nothing more to show; start with `list`, `listfor`, `listall` or `listun`"
+    try:
+        return list_page(cursor, listing, listing['offset'])
+    except:
+        traceback.print_exc(file=sys.stderr)
+        raise RuntimeError(":x: List operation failed")
+
+def list_page(cursor, listing, offset=0):
+    """
+        Render one page of a listing, fetching only that page from Redmine;
+        when more remain the listing is kept under `cursor` for `more`
+    """
+    result = listing['fetch'](LIST_PAGE_SIZE, offset)
+    issues = list(result)
+    if len(issues) == 0:
+        LIST_CURSORS.invalidate(cursor)
+        if offset == 0:
+            return listing['empty']
+        return ":thumbsup_all: No more issues to show"
+    total = result.total_count
+    shown = offset + len(issues)
+    lines = [listing['title']]
+    with TRACER.span('render', issues=len(issues)):
+        lines.extend(issue_detail(issue, extended=False, user=listing['user']) for issue in issues)
+    if shown < total and cursor is not None:
+        LIST_CURSORS.put(cursor, dict(listing, offset=shown))
+        lines.append("_Showing "+str(offset+1)+"-"+str(shown)+" of "+str(total)+ \
+                     " - use `more` for the next page_\n")
+    else:
+        LIST_CURSORS.invalidate(cursor)
+        if offset > 0:
+            lines.append("_Showing "+str(offset+1)+"-"+str(shown)+" of "+str(total)+"_\n")
+    return "".join(lines)
+
 ### Scrum, EOD, EOW commands
 
-def cmd_daily_scrum(username):
+def cmd_daily_scrum(username, reply=None):
+    calls = rm_call_count()
     user = rm_get_user(username)
     try:
-        response = ":newspaper: *Daily Scrum Report for "+user.firstname+" "+user.lastname+":*\n"
+        lines = [":newspaper: *Daily Scrum Report for "+user.firstname+" "+user.lastname+":*\n"]
+        report_progress(reply, lines[0])
         issues_found = False
-        for s in SCRUM_ORDER:
-            result = rm_get_user_issues(user.id, s)
+        # start every query now; each section is shown once its data is in
+        open_task = ReportTask(rm_get_user_issues_by_status, user.id, SCRUM_ORDER)
+        watched_task = ReportTask(rm_get_user_issues_watched, user.login, user.id)
+        results = open_task.get()
+        hours = rm_sum_time_entries_issues([i for (s, r) in results for i in r])
+        for (s, result) in results:
             if len(result) > 0:
                 issues_found = True
-                response += "*_"+STATUS_NAME_LOOKUP[s]+" ("+str(len(result))+")_*\n"
-                for issue in result:
-                    response += issue_detail(issue, extended=True, user=False)
+                lines.append("*_"+lookup_status(s)+" ("+str(len(result))+")_*\n")
+                with TRACER.span('render', status=s, issues=len(result)):
+                    for issue in result:
+                        lines.append(issue_detail(issue, extended=True, user=False, hours=hours))
+        report_progress(reply, "".join(lines))
         # check for issues user is a watcher
-        watching = rm_get_user_issues_watched(user.login)
+        watching = watched_task.get()
+        hours.update(rm_sum_time_entries_issues([i for i in watching if i.id not in hours]))
         if len(watching) > 0:
             issues_found = True
-            response += ":eyes: *_Watched ("+str(len(watching))+")_*\n"
-            for issue in watching:
-                response += issue_detail(issue, extended=True, user=True)
+            lines.append(":eyes: *_Watched ("+str(len(watching))+")_*\n")
+            with TRACER.span('render', section='watched', issues=len(watching)):
+                for issue in watching:
+                    lines.append(issue_detail(issue, extended=True, user=True, hours=hours))
         if not issues_found:
-            response += ":thumbsup_all: No issues found!\n"
-        return response
+            lines.append(":thumbsup_all: No issues found!\n")
+        debug("scrum for "+username+" made "+str(rm_call_count() - calls)+" Redmine calls")
+        return "".join(lines)
     except:
         traceback.print_exc(file=sys.stderr)
         raise RuntimeError(":x: Scrum operation failed")
 
-def cmd_daily_eod(username):
+def cmd_daily_eod(username, reply=None):
     user = rm_get_user(username)
-    try:
-        response = ":newspaper: *End of Day Report for "+user.firstname+" "+user.lastname+":*\n"
-        issues_found = False
-        time_entries = rm_sum_time_entries_user_today(user.id)
-        total_hours = 0.0
-        for s in EOD_ORDER:
-            result = rm_get_user_issues_today(user.id, s)
-            if len(result) > 0:
-                hours_spent = 0.0
-                issue_details = ""
-                issues_found = True
-                for issue in result:
-                    if issue.id in time_entries:
-                        issue_details += issue_detail_hours(issue, time_entries[issue.id])
-                        hours_spent += time_entries[issue.id]
-                        del time_entries[issue.id]
-                    else:
-                        issue_details += issue_detail(issue, extended=True, user=False)
-                response += "*_"+lookup_status(s)+" ("+str(len(result))+") Hours: "+str(hours_spent)+"_*\n"
-                response += issue_details
-                total_hours += hours_spent
-        for s in SCRUM_ORDER:
-            result = rm_get_user_issues(user.id, s)
-            if len(result) > 0:
-                hours_spent = 0.0
-                issue_details = ""
-                issues_found = True
-                for issue in result:
-                    if issue.id in time_entries:
-                        issue_details += issue_detail_hours(issue, time_entries[issue.id])
-                        hours_spent += time_entries[issue.id]
-                        del time_entries[issue.id]
-                    else:
-                        issue_details += issue_detail(issue, extended=True, user=False)
-                response += "*_"+lookup_status(s)+" ("+str(len(result))+") Hours: "+str(hours_spent)+"_*\n"
-                response += issue_details
-                total_hours += hours_spent
-        if len(time_entries) > 0:
-            # Remaining issues that were contributed to
-            issues_found = True
-            contribution_hours = 0.0
-            issue_details = ""
-            for issueid in time_entries:
-                contribution_hours += time_entries[issueid]
-                issue = rm_get_issue(issueid)
-                issue_details += issue_detail_hours(issue, time_entries[issueid])
-            response += "*_Contributions ("+str(len(time_entries))+") Hours: "+str(contribution_hours)+"_*\n"
-            response += issue_details
-            total_hours += contribution_hours
-        # check for issues user is a watcher
-        watching = rm_get_user_issues_watched(user.login)
-        if len(watching) > 0:
-            issues_found = True
-            response += ":eyes: *_Watched ("+str(len(watching))+")_*\n"
-            for issue in watching:
-                response += issue_detail(issue, extended=True, user=True)
-        response += "*_Total Hours: "+str(total_hours)+"_*\n"
-        if not issues_found:
-            response += ":thumbsup_all: No issues found!\n"
-        return response
-    except:
-        traceback.print_exc(file=sys.stderr)
-        raise RuntimeError(":x: EOD operation failed")
+    return report_hours(user, "End of Day", "EOD", \
+                        rm_sum_time_entries_user_today, rm_get_user_issues_today, reply)
 
-def cmd_weekly_eow(username):
+def cmd_weekly_eow(username, reply=None):
     user = rm_get_user(username)
+    return report_hours(user, "End of Week", "EOW", \
+                        rm_sum_time_entries_user_week, rm_get_user_issues_week, reply)
+
+def report_hours(user, title, operation, sum_time_entries, get_done_issues, reply=None):
+    """
+        Shared end of day/week report: closed/rejected and open issues with
+        the hours logged against them, issues only contributed to, and
+        watched issues; `sum_time_entries` and `get_done_issues` select
+        the reporting period
+    """
     try:
-        response = ":newspaper: *End of Week Report for "+user.firstname+" "+user.lastname+":*\n"
+        lines = [":newspaper: *"+title+" Report for "+user.firstname+" "+user.lastname+":*\n"]
+        report_progress(reply, lines[0])
         issues_found = False
-        time_entries = rm_sum_time_entries_user_week(user.id)
         total_hours = 0.0
-        for s in EOD_ORDER:
-            result = rm_get_user_issues_week(user.id, s)
+        # start every query now; each section is shown once its data is in
+        entries_task = ReportTask(sum_time_entries, user.id)
+        done_tasks = [(s, ReportTask(get_done_issues, user.id, s)) for s in EOD_ORDER]
+        open_task = ReportTask(rm_get_user_issues_by_status, user.id, SCRUM_ORDER)
+        watched_task = ReportTask(rm_get_user_issues_watched, user.login, user.id)
+        time_entries = entries_task.get()
+        sections = [(s, task.get()) for (s, task) in done_tasks] + open_task.get()
+        listed = set(issue_ids([r for (s, r) in sections]))
+        contributions_task = ReportTask(rm_get_issues, [i for i in time_entries if i not in listed])
+        hours = rm_sum_time_entries_issues([i for (s, r) in sections for i in r])
+        for (s, result) in sections:
             if len(result) > 0:
                 hours_spent = 0.0
-                issue_details = ""
+                issue_details = []
                 issues_found = True
-                for issue in result:
-                    if issue.id in time_entries:
-                        issue_details += issue_detail_hours(issue, time_entries[issue.id])
-                        hours_spent += time_entries[issue.id]
-                        del time_entries[issue.id]
-                    else:
-                        issue_details += issue_detail(issue, extended=True, user=False)
-                response += "*_"+lookup_status(s)+" ("+str(len(result))+") Hours: "+str(hours_spent)+"_*\n"
-                response += issue_details
+                with TRACER.span('render', status=s, issues=len(result)):
+                    for issue in result:
+                        if issue.id in time_entries:
+                            issue_details.append(issue_detail_hours(issue, time_entries[issue.id], hours=hours))
+                            hours_spent += time_entries[issue.id]
+                        else:
+                            issue_details.append(issue_detail(issue, extended=True, user=False, hours=hours))
+                lines.append("*_"+lookup_status(s)+" ("+str(len(result))+") Hours: "+str(hours_spent)+"_*\n")
+                lines.extend(issue_details)
                 total_hours += hours_spent
-        for s in SCRUM_ORDER:
-            result = rm_get_user_issues(user.id, s)
-            if len(result) > 0:
-                hours_spent = 0.0
-                issue_details = ""
-                issues_found = True
-                for issue in result:
-                    if issue.id in time_entries:
-                        issue_details += issue_detail_hours(issue, time_entries[issue.id])
-                        hours_spent += time_entries[issue.id]
-                        del time_entries[issue.id]
-                    else:
-                        issue_details += issue_detail(issue, extended=True, user=False)
-                response += "*_"+lookup_status(s)+" ("+str(len(result))+") Hours: "+str(hours_spent)+"_*\n"
-                response += issue_details
-                total_hours += hours_spent
-        if len(time_entries) > 0:
-            # Remaining issues that were contributed to
+        report_progress(reply, "".join(lines))
+        # Remaining issues that were contributed to, fetched in bulk
+        contributions = contributions_task.get()
+        hours.update(rm_sum_time_entries_issues(contributions))
+        if len(contributions) > 0:
             issues_found = True
             contribution_hours = 0.0
-            issue_details = ""
-            for issueid in time_entries:
-                contribution_hours += time_entries[issueid]
-                issue = rm_get_issue(issueid)
-                issue_details += issue_detail_hours(issue, time_entries[issueid])
-            response += "*_Contributions ("+str(len(time_entries))+") Hours: "+str(contribution_hours)+"_*\n"
-            response += issue_details
+            issue_details = []
+            with TRACER.span('render', section='contributions', issues=len(contributions)):
+                for issue in contributions:
+                    contribution_hours += time_entries[issue.id]
+                    issue_details.append(issue_detail_hours(issue, time_entries[issue.id], hours=hours))
+            lines.append("*_Contributions ("+str(len(contributions))+") Hours: "+str(contribution_hours)+"_*\n")
+            lines.extend(issue_details)
             total_hours += contribution_hours
+            report_progress(reply, "".join(lines))
         # check for issues user is a watcher
-        watching = rm_get_user_issues_watched(user.login)
+        watching = watched_task.get()
+        hours.update(rm_sum_time_entries_issues([i for i in watching if i.id not in hours]))
         if len(watching) > 0:
             issues_found = True
-            response += ":eyes: *_Watched ("+str(len(watching))+")_*\n"
-            for issue in watching:
-                response += issue_detail(issue, extended=True, user=True)
-        response += "*_Total Hours: "+str(total_hours)+"_*\n"
+            lines.append(":eyes: *_Watched ("+str(len(watching))+")_*\n")
+            with TRACER.span('render', section='watched', issues=len(watching)):
+                for issue in watching:
+                    lines.append(issue_detail(issue, extended=True, user=True, hours=hours))
+        lines.append("*_Total Hours: "+str(total_hours)+"_*\n")
         if not issues_found:
-            response += ":thumbsup_all: No issues found!\n"
-        return response
+            lines.append(":thumbsup_all: No issues found!\n")
+        return "".join(lines)
     except:
         traceback.print_exc(file=sys.stderr)
-        raise RuntimeError(":x: EOW operation failed")
+        raise RuntimeError(":x: "+operation+" operation failed")
 
 ### Top 5 commands
 
@@ -703,21 +1291,25 @@ def cmd_list_top5(username):
     user = rm_get_user(username)
     try:
         top5_found = False
-        response = ":pushpin: *Top 5 for "+user.firstname+" "+user.lastname+":*\n"
-        for p in range(5, 0, -1):
-            result = rm_get_top5(user.id, p)
-            rank = 6 - p
-            cnt = 1
-            for issue in result:
-                if len(result) > 1:
-                    response += top5_detail(issue, rank, cnt)
-                    cnt += 1
-                else:
-                    response += top5_detail(issue, rank)
-                top5_found = True
+        lines = [":pushpin: *Top 5 for "+user.firstname+" "+user.lastname+":*\n"]
+        top5 = list(rm_get_top5(user.id))
+        results = [(p, [i for i in top5 if i.priority.id == p]) for p in range(5, 0, -1)]
+        watchers = rm_get_watchers(top5)
+        hours = rm_sum_time_entries_issues(top5)
+        with TRACER.span('render', issues=len(top5)):
+            for (p, result) in results:
+                rank = 6 - p
+                cnt = 1
+                for issue in result:
+                    if len(result) > 1:
+                        lines.append(top5_detail(issue, rank, cnt, hours=hours, watchers=watchers))
+                        cnt += 1
+                    else:
+                        lines.append(top5_detail(issue, rank, hours=hours, watchers=watchers))
+                    top5_found = True
         if not top5_found:
-            response = ":thumbsup_all: No Top 5 for "+user.firstname+" "+user.lastname
-        return response
+            return ":thumbsup_all: No Top 5 for "+user.firstname+" "+user.lastname
+        return "".join(lines)
     except:
         traceback.print_exc(file=sys.stderr)
         raise RuntimeError(":x: Top 5 list operation failed")
@@ -809,6 +1401,62 @@ def cmd_watcher_delete(text, issueid, username, watchername):
         traceback.print_exc(file=sys.stderr)
         raise RuntimeError(":x: Watcher deletion failed")
 
+### Admin commands
+
+def cmd_profile(command, channel, user, username):
+    """
+        Run `command` as if the admin had sent it, under cProfile, and
+        report where the time went; the command replies as usual
+    """
+    # the Slack name may match a Redmine user by name or e-mail; admins
+    # are listed by login
+    if rm_get_user(username).login not in BOT_ADMINS:
+        return ":no_entry: `profile` is only available to bot admins"
+    if command_operator(command) == 'profile':
+        return ":x: Cannot profile the `profile` command"
+    calls = rm_call_count()
+    slack_calls = sc_call_count()
+    profiler = cProfile.Profile()
+    start = time.time()
+    PROFILING.active = True
+    profiler.enable()
+    try:
+        handle_command(command, channel, user, username)
+    finally:
+        profiler.disable()
+        PROFILING.active = False
+    elapsed = time.time() - start
+    response = ":stopwatch: *Profile of `"+command+"`:* "+"%.3fs" % elapsed+", " \
+               +str(rm_call_count() - calls)+" Redmine calls, " \
+               +str(sc_call_count() - slack_calls)+" Slack calls\n" \
+               +"```"+profile_summary(profiler, PROFILE_TOP)+"```\n"
+    if PROFILE_DIR:
+        path = os.path.join(PROFILE_DIR, "profile-"+command_operator(command)+"-" \
+                            +datetime.now().strftime('%Y%m%d-%H%M%S')+".pstats")
+        try:
+            profiler.dump_stats(path)
+            response += "Saved stats to `"+path+"`\n"
+        except:
+            traceback.print_exc(file=sys.stderr)
+            response += ":x: Failed to save stats to `"+path+"`\n"
+    return response
+
+def profile_summary(profiler, top):
+    """
+        Functions with the most cumulative time, one per line
+    """
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    lines = ["   cumtime  tottime    calls  function"]
+    for ((filename, line, name), (cc, nc, tt, ct, callers)) in rows:
+        if filename == '~':
+            where = name
+        else:
+            where = os.path.basename(filename)+":"+str(line)+"("+name+")"
+        calls = str(nc) if nc == cc else str(nc)+"/"+str(cc)
+        lines.append("%10.3f %8.3f %8s  %s" % (ct, tt, calls, where))
+    return "\n".join(lines)
+
 """
     Redmine functions
 """
@@ -838,17 +1486,16 @@ def rm_check_username(username):
 
 def rm_get_project(project):
     try:
-        return rc.project.get(project)
+        return PROJECT_INDEX.project(project)
     except:
         traceback.print_exc(file=sys.stderr)
         raise RuntimeError(":x: Failed to find project `"+project+"` in Redmine")
 
 def rm_get_version(project, version):
     try:
-        proj = rm_get_project(project)
-        for v in proj.versions:
-            if v.name.lower() == version.lower():
-                return v
+        v = PROJECT_INDEX.version(rm_get_project(project), version)
+        if v is not None:
+            return v
         raise RuntimeError(":x: Failed to find version `"+version+"` within project `"+project+"` in Redmine")
     except:
         traceback.print_exc(file=sys.stderr)
@@ -861,8 +1508,32 @@ def rm_get_issue(issueid):
         traceback.print_exc(file=sys.stderr)
         raise RuntimeError(":x: Failed to find issue ID `"+issueid+"` in Redmine")
 
-def rm_get_user_issues(userid, status, project=None):
+def rm_get_issues(issueids):
+    """
+        Fetch many issues of any status with one `issue_id=1,2,3` query per
+        chunk of IDs, returned in the order the IDs were given
+    """
+    issueids = [int(i) for i in issueids]
+    found = {}
+    try:
+        if mirror_ready() and issueids:
+            for issue in mirror_issues(status='*', ids=issueids):
+                found[issue.id] = issue
+            return [found[i] for i in issueids if i in found]
+        for i in range(0, len(issueids), ISSUE_ID_CHUNK):
+            chunk = issueids[i:i+ISSUE_ID_CHUNK]
+            for issue in rc.issue.filter(issue_id=",".join(str(c) for c in chunk), status_id='*'):
+                found[issue.id] = issue
+    except:
+        traceback.print_exc(file=sys.stderr)
+        raise RuntimeError(":x: Failed to find issue IDs `"+",".join(str(i) for i in issueids)+"` in Redmine")
+    return [found[i] for i in issueids if i in found]
+
+def rm_get_user_issues(userid, status, project=None, limit=None, offset=None):
     params = dict()
+    if limit:
+        params['limit'] = limit
+        params['offset'] = offset or 0
     if not status:
         params['status_id'] = 'open'
     else:
@@ -870,20 +1541,39 @@ def rm_get_user_issues(userid, status, project=None):
     if project:
         params['project_id'] = project
     try:
+        if mirror_ready():
+            return mirror_issues(project, status=params['status_id'], assigned_to=userid, \
+                                 limit=limit, offset=offset)
         return rc.issue.filter(sort='priority:desc', assigned_to_id=userid, **params)
     except:
         traceback.print_exc(file=sys.stderr)
-        raise RuntimeError(":x: Failed to find issues for user `"+username+"` in Redmine")
+        raise RuntimeError(":x: Failed to find issues for user `"+str(userid)+"` in Redmine")
+
+def rm_get_user_issues_by_status(userid, order):
+    """
+        Fetch all issues assigned to the user in any status of `order` in one
+        query and bucket them by status, returning (status ID, issues) pairs
+        in `order`
+    """
+    buckets = dict((str(s), []) for s in order)
+    for issue in rm_get_user_issues(userid, '|'.join(str(s) for s in order)):
+        status = str(issue.status.id)
+        if status in buckets:
+            buckets[status].append(issue)
+    return [(s, buckets[str(s)]) for s in order]
 
 def rm_get_user_issues_today(userid, status):
     if not status:
         status = 'open'
     try:
         today = datetime.today().date()
+        if mirror_ready():
+            (start, end) = mirror_updated_between(today, today)
+            return mirror_issues(status=status, assigned_to=userid, updated_from=start, updated_to=end)
         return rc.issue.filter(sort='priority:desc', assigned_to_id=userid, status_id=status, updated_on=today)
     except:
         traceback.print_exc(file=sys.stderr)
-        raise RuntimeError(":x: Failed to find issues for user `"+username+"` in Redmine")
+        raise RuntimeError(":x: Failed to find issues for user `"+str(userid)+"` in Redmine")
 
 def rm_get_user_issues_week(userid, status):
     if not status:
@@ -891,18 +1581,29 @@ def rm_get_user_issues_week(userid, status):
     try:
         today = datetime.today().date()
         last_week = (datetime.today() - timedelta(days=7)).date()
+        if mirror_ready():
+            (start, end) = mirror_updated_between(last_week, today)
+            return mirror_issues(status=status, assigned_to=userid, updated_from=start, updated_to=end)
         return rc.issue.filter(sort='priority:desc', assigned_to_id=userid, status_id=status, updated_on='><'+str(last_week)+'|'+str(today))
     except:
         traceback.print_exc(file=sys.stderr)
-        raise RuntimeError(":x: Failed to find issues for user `"+username+"` in Redmine")
+        raise RuntimeError(":x: Failed to find issues for user `"+str(userid)+"` in Redmine")
 
-def rm_get_user_issues_watched(userlogin):
+def rm_get_user_issues_watched(userlogin, userid=None):
+    """
+        Issues returned by the watched issues query run as the user; the
+        mirror keeps the IDs it returned under the user's ID
+    """
     try:
-        rcn = rm_impersonate(userlogin)
-        return rcn.issue.filter(sort='priority:desc', query_id=REDMINE_WATCHED_QUERY_ID)
+        query = lambda: rm_impersonate(userlogin).issue.filter(sort='priority:desc', \
+                                                              query_id=REDMINE_WATCHED_QUERY_ID)
+        if userid is not None and mirror_ready():
+            MIRROR.sync_watched(userid, query)
+            return mirror_issues(status='*', watcher=userid)
+        return query()
     except:
         traceback.print_exc(file=sys.stderr)
-        raise RuntimeError(":x: Failed to find watched issues for user `"+username+"` in Redmine")
+        raise RuntimeError(":x: Failed to find watched issues for user `"+userlogin+"` in Redmine")
 
 def rm_get_user_issues_date(userid, status, date):
     if not status:
@@ -911,10 +1612,13 @@ def rm_get_user_issues_date(userid, status, date):
         return rc.issue.filter(sort='priority:desc', assigned_to_id=userid, status_id=status, updated_on=date)
     except:
         traceback.print_exc(file=sys.stderr)
-        raise RuntimeError(":x: Failed to find issues for user `"+username+"` in Redmine")
+        raise RuntimeError(":x: Failed to find issues for user `"+str(userid)+"` in Redmine")
 
-def rm_get_all_issues(status, unassigned, project):
+def rm_get_all_issues(status, unassigned, project, limit=None, offset=None):
     params = dict()
+    if limit:
+        params['limit'] = limit
+        params['offset'] = offset or 0
     if not status:
         params['status_id'] = 'open'
     else:
@@ -925,17 +1629,20 @@ def rm_get_all_issues(status, unassigned, project):
         unassigned = False
 
     try:
+        if mirror_ready():
+            return mirror_issues(project, status=params['status_id'], unassigned=unassigned, \
+                                 limit=limit, offset=offset)
         if unassigned:
             return rc.issue.filter(sort='priority:desc', assigned_to_id='!*', **params)
         else:
             return rc.issue.filter(sort='priority:desc', **params)
     except:
         traceback.print_exc(file=sys.stderr)
-        raise RuntimeError(":x: Failed to find issues for user `"+username+"` in Redmine")
+        raise RuntimeError(":x: Failed to find issues in Redmine")
 
 def rm_impersonate(userlogin):
     try:
-        return Redmine(REDMINE_HOST, version=REDMINE_VERSION, key=REDMINE_TOKEN, impersonate=userlogin)
+        return RC_POOL.get(userlogin)
     except:
         traceback.print_exc(file=sys.stderr)
         raise RuntimeError(":x: Failed impersonate user `"+userlogin+"` in Redmine")
@@ -1005,14 +1712,47 @@ def rm_sum_time_entries(issueid):
         traceback.print_exc(file=sys.stderr)
         raise RuntimeError(":x: Failed in summing time entries")
 
+def rm_sum_time_entries_issues(issues):
+    """
+        Sum spent hours for many issues, returning a map of issue ID to
+        hours (0.0 when none logged). Issues loaded with their `spent_hours`
+        are read as they are; Redmine filters time entries by one issue at a
+        time, so the rest are queried one issue each, in parallel on the
+        report pool
+    """
+    results = {}
+    missing = []
+    for issue in issues:
+        raw = issue.raw()
+        if raw.get('spent_hours') is not None:
+            results[raw['id']] = float(raw['spent_hours'])
+        elif raw['id'] not in results:
+            results[raw['id']] = 0.0
+            missing.append(raw['id'])
+    try:
+        if mirror_ready():
+            return MIRROR.spent_hours(list(results))
+        tasks = [(i, ReportTask(sum_issue_time_entries, i)) for i in missing]
+        for (i, task) in tasks:
+            results[i] = task.get()
+        return results
+    except:
+        traceback.print_exc(file=sys.stderr)
+        raise RuntimeError(":x: Failed in summing time entries")
+
+def sum_issue_time_entries(issueid):
+    return sum((te.hours for te in rc.time_entry.filter(issue_id=issueid)), 0.0)
+
 def rm_get_time_entries_user(userid, fromdate):
     try:
         return rc.time_entry.filter(user_id=userid, from_date=fromdate)
     except:
         traceback.print_exc(file=sys.stderr)
-        raise RuntimeError(":x: Failed to find time entries for `"+username+"` in Redmine")
+        raise RuntimeError(":x: Failed to find time entries for `"+str(userid)+"` in Redmine")
 
 def rm_sum_time_entries_user(userid, fromdate):
+    if mirror_ready():
+        return MIRROR.user_hours(userid, fromdate)
     results = {}
     for e in rm_get_time_entries_user(userid, fromdate):
         if e.issue.id in results:
@@ -1029,12 +1769,45 @@ def rm_sum_time_entries_user_week(userid):
     last_week = (datetime.today() - timedelta(days=7)).date()
     return rm_sum_time_entries_user(userid, last_week)
 
-def rm_get_top5(userid, priority):
+def rm_get_top5(userid):
+    """
+        All open Top 5 issues authored by the user in created order, with
+        their watchers where Redmine includes them in lists
+    """
+    try:
+        if mirror_ready():
+            # Top 5 issues live directly in the project, not in subprojects
+            return mirror_issues(status='open', author=userid, order='created', \
+                                 projects=[rm_get_project(REDMINE_TOP5_PROJECT).id])
+        return rc.issue.filter(sort='created_on', project_id=REDMINE_TOP5_PROJECT, subproject_id='!*', author_id=userid, status_id='open', include='watchers')
+    except:
+        traceback.print_exc(file=sys.stderr)
+        raise RuntimeError(":x: Failed to find Top 5 for user `"+str(userid)+"` in Redmine")
+
+def rm_get_watchers(issues):
+    """
+        Map of issue ID to raw watchers. Issue lists only carry watchers on
+        Redmine versions that include them; the rest are fetched one issue
+        each, in parallel on the report pool
+    """
+    results = {}
+    tasks = []
+    for issue in issues:
+        raw = issue.raw()
+        if 'watchers' in raw:
+            results[raw['id']] = raw['watchers']
+        else:
+            tasks.append((raw['id'], ReportTask(rm_get_issue_watchers, raw['id'])))
+    for (issueid, task) in tasks:
+        results[issueid] = task.get()
+    return results
+
+def rm_get_issue_watchers(issueid):
     try:
-        return rc.issue.filter(sort='created_on', project_id=REDMINE_TOP5_PROJECT, subproject_id='!*', author_id=userid, status_id='open', priority_id=priority)
+        return rc.issue.get(issueid, include='watchers').raw().get('watchers', [])
     except:
         traceback.print_exc(file=sys.stderr)
-        raise RuntimeError(":x: Failed to find Top 5 for user `"+username+"` in Redmine")
+        raise RuntimeError(":x: Failed to find watchers of issue `"+str(issueid)+"` in Redmine")
 
 def rm_get_statuses():
     try:
@@ -1046,7 +1819,7 @@ def rm_get_statuses():
 def rm_get_status(statusid):
     try:
         for status in rm_get_statuses():
-            if status.id == statusid:
+            if status.id == int(statusid):
                 return status.name
     except:
         traceback.print_exc(file=sys.stderr)
@@ -1057,10 +1830,14 @@ def rm_get_status(statusid):
     Status functions
 """
 def get_status(status):
-    try:
-        return STATUSES.get(status)[0], STATUSES.get(status)[1]
-    except:
-        raise RuntimeError(":x: Unknown status code, use one of the following:\n"+list_statuses())
+    if status in STATUSES:
+        statusid = STATUSES[status][0]
+        return statusid, lookup_status(statusid)
+    # also accept any status by its Redmine name, e.g. `resolved`
+    statusid = CATALOG.id('statuses', status)
+    if statusid:
+        return statusid, CATALOG.name('statuses', statusid)
+    raise RuntimeError(":x: Unknown status code, use one of the following:\n"+list_statuses())
 
 def list_status_keys():
     response = ""
@@ -1071,14 +1848,43 @@ def list_status_keys():
 def list_statuses():
     response = ""
     for i in STATUSES:
-        response += "`"+i+"` - "+STATUSES[i][1]+"\n"
+        response += "`"+i+"` - "+lookup_status(STATUSES[i][0])+"\n"
     return response
 
 def lookup_status(status):
+    name = CATALOG.name('statuses', status)
+    if name is not None:
+        return name
     if status in STATUS_NAME_LOOKUP:
         return STATUS_NAME_LOOKUP[status]
-    else:
-        return rm_get_status(status)
+    name = STATUS_NAME_CACHE.get(status)
+    if name is None:
+        name = rm_get_status(status)
+        if name is not None:
+            STATUS_NAME_CACHE.put(status, name)
+    return name
+
+"""
+    Name lookup functions
+"""
+def lookup_user_name(userid):
+    name = USER_NAME_CACHE.get(str(userid))
+    if name is None:
+        user = rm_get_user_by_id(userid)
+        name = user.firstname+" "+user.lastname
+        USER_NAME_CACHE.put(str(userid), name)
+    return name
+
+def lookup_project_name(projectid):
+    name = PROJECT_NAME_CACHE.get(str(projectid))
+    if name is None:
+        name = rm_get_project(str(projectid)).name
+        PROJECT_NAME_CACHE.put(str(projectid), name)
+    return name
+
+def invalidate_name_caches():
+    for cache in NAME_CACHES:
+        cache.invalidate()
 
 """
     Response formatting functions
@@ -1089,30 +1895,70 @@ def issue_url(issueid):
 def issue_subject_url(issueid, subject):
     return "<"+REDMINE_EXT_HOST+"/issues/"+str(issueid)+"|#"+str(issueid)+" "+subject+">"
 
-def issue_time_percent_details(issue):
-    estimated = check_key_exists(issue, 'estimated_hours')
-    start = check_key_exists(issue, 'start_date')
-    due = check_key_exists(issue, 'due_date')
-    response = ""
-    spent = rm_sum_time_entries(issue.id)
-    if start:
-        response += " ("+str(issue.start_date)+">"
-    else:
-        response += " (?>"
-    if due:
-        response += str(issue.due_date)+")"
-    else:
-        response += "?)"
-    if estimated:
-        response += " ["+str(issue.estimated_hours)+"h/"+str(spent)+"h]"
+def issue_time_percent_details(issue, hours=None):
+    """
+        `hours` is an optional map of issue ID to spent hours prefetched
+        with rm_sum_time_entries_issues; without it the issue is summed alone
+    """
+    if hours is not None and issue.id in hours:
+        spent = hours[issue.id]
     else:
-        response += " [?/"+str(spent)+"h]"
-    response += " "+str(issue.done_ratio)+"%"
-    return response
+        spent = rm_sum_time_entries(issue.id)
+    fragments = issue_fragments(issue)
+    # logging time does not touch updated_on so spent hours are not cached
+    return fragments['dates']+fragments['estimated']+str(spent)+fragments['done']
+
+def issue_fragments(issue):
+    """
+        Formatted pieces of an issue's report line built from the raw JSON
+        to skip per-attribute resource decoding. Pieces that only change
+        when the issue itself is updated are cached by issue ID and
+        updated_on; project, version, status and user names can be renamed
+        without touching the issue, so they are taken from the raw JSON on
+        every call
+    """
+    raw = issue.raw()
+    key = (raw['id'], raw.get('updated_on'))
+    fragments = ISSUE_LINE_CACHE.get(key)
+    if fragments is None:
+        dates = " ("+(str(raw['start_date']) if 'start_date' in raw else "?")+">"+ \
+                (str(raw['due_date']) if 'due_date' in raw else "?")+")"
+        if 'estimated_hours' in raw:
+            estimated = " ["+str(raw['estimated_hours'])+"h/"
+        else:
+            estimated = " [?/"
+        fragments = {
+            'rank': issue_rank_tag(priority_to_rank(raw['priority']['id'])),
+            'subject': issue_subject_url(raw['id'], raw['subject']),
+            'dates': dates,
+            'estimated': estimated,
+            'done': "h] "+str(raw['done_ratio'])+"%",
+            'created': issue.created_on,
+            'updated': issue.updated_on
+        }
+        ISSUE_LINE_CACHE.put(key, fragments)
+    version = ""
+    if 'fixed_version' in raw:
+        version = " - "+raw['fixed_version']['name']
+    user = ""
+    top5_user = ""
+    if 'assigned_to' in raw:
+        user = " :bookmark: "+raw['assigned_to']['name']
+        if raw['assigned_to']['name'] != raw['author']['name']:
+            top5_user = " :bookmark: *"+raw['assigned_to']['name']+"*"
+    names = {
+        'project': "*"+raw['project']['name']+version+"* "+fragments['subject'],
+        'status': "*"+raw['status']['name']+"*",
+        'user': user,
+        'top5_user': top5_user
+    }
+    names.update(fragments)
+    return names
 
 def issue_tag(created, updated):
-    cdate = utc2local(created).date()
-    udate = utc2local(updated).date()
+    offset = local_offset()
+    cdate = (created + offset).date()
+    udate = (updated + offset).date()
     today = datetime.today().date()
 
     if cdate == today:
@@ -1132,33 +1978,6 @@ def issue_tag(created, updated):
             return ":snowflake:"
     return ":grey_question:"
 
-def issue_version(issue):
-    if check_key_exists(issue, 'fixed_version'):
-        return " - "+issue.fixed_version.name
-    else:
-        return ""
-
-def issue_user(issue):
-    if check_key_exists(issue, 'assigned_to'):
-        return " :bookmark: "+issue.assigned_to.name
-    else:
-        return ""
-
-def issue_top5_user(issue):
-    if check_key_exists(issue, 'assigned_to') and issue.assigned_to.name != issue.author.name:
-        return " :bookmark: *"+issue.assigned_to.name+"*"
-    else:
-        return ""
-
-def issue_status(issue):
-    return "*"+issue.status.name+"*"
-
-def issue_rank(issue):
-    priority = issue.priority.id
-    rank = priority_to_rank(priority)
-    rank = issue_rank_tag(rank)
-    return ""+rank+""
-
 def issue_rank_tag(rank):
     tag = ""
     if rank == 1:
@@ -1175,33 +1994,25 @@ def issue_rank_tag(rank):
         tag = ":question:"
     return tag
 
-def issue_detail(issue, extended=False, user=False, description=False):
-    version = issue_version(issue)
-    tag = issue_tag(issue.created_on, issue.updated_on)
-    rank = issue_rank(issue)
-    response = "> "+tag+" "+rank+" *"+issue.project.name+version+"* "+ \
-               issue_subject_url(issue.id, issue.subject)
+def issue_detail(issue, extended=False, user=False, description=False, hours=None):
+    fragments = issue_fragments(issue)
+    tag = issue_tag(fragments['created'], fragments['updated'])
+    parts = ["> ", tag, " ", fragments['rank'], " ", fragments['project']]
     if extended:
-        response += issue_time_percent_details(issue)
+        parts.append(issue_time_percent_details(issue, hours))
     if user:
-        username = issue_user(issue)
-        response += username
+        parts.append(fragments['user'])
     if description and "description" in issue and issue.description != "":
-        response += "\n*Description:*\n"+issue_comment(issue.description)
+        parts.append("\n*Description:*\n"+issue_comment(issue.description))
     else:
-        response += "\n"
-    return response
+        parts.append("\n")
+    return "".join(parts)
 
-def issue_detail_hours(issue, spent):
-    version = issue_version(issue)
-    tag = issue_tag(issue.created_on, issue.updated_on)
-    rank = issue_rank(issue)
-    response = "> "+tag+" "+rank+" _| "+str(spent)+"h |_ *"+issue.project.name+version+"* "+ \
-               issue_subject_url(issue.id, issue.subject)
-    response += issue_time_percent_details(issue)
-
-    response += "\n"
-    return response
+def issue_detail_hours(issue, spent, hours=None):
+    fragments = issue_fragments(issue)
+    tag = issue_tag(fragments['created'], fragments['updated'])
+    return "".join(["> ", tag, " ", fragments['rank'], " _| ", str(spent), "h |_ ", \
+                    fragments['project'], issue_time_percent_details(issue, hours), "\n"])
 
 def issue_journal_details(issue):
     journals = rc.issue.get(issue.id, include='journals')
@@ -1230,8 +2041,8 @@ def issue_journal_details(issue):
                     new = str(detail['new_value'])+"%"
                 elif detail['name'] == "project_id":
                     change = "Project"
-                    old = rm_get_project(detail['old_value']).name
-                    new = rm_get_project(detail['new_value']).name
+                    old = lookup_project_name(detail['old_value'])
+                    new = lookup_project_name(detail['new_value'])
                 elif detail['name'] == "start_date":
                     change = "Start Date"
                 elif detail['name'] == "due_date":
@@ -1246,16 +2057,18 @@ def issue_journal_details(issue):
                     new = str(priority_to_rank(detail['new_value']))
                 elif detail['name'] == "tracker_id":
                     change = "Tracker"
+                    if 'old_value' in detail and CATALOG.name('trackers', detail['old_value']):
+                        old = CATALOG.name('trackers', detail['old_value'])
+                    if 'new_value' in detail and CATALOG.name('trackers', detail['new_value']):
+                        new = CATALOG.name('trackers', detail['new_value'])
                 elif detail['name'] == "assigned_to_id":
                     change = "Assigned"
                     if 'old_value' in detail:
-                        old_user = rm_get_user_by_id(detail['old_value'])
-                        old = old_user.firstname+" "+old_user.lastname
+                        old = lookup_user_name(detail['old_value'])
                     else:
                         old = "Unassigned"
                     if 'new_value' in detail:
-                        new_user = rm_get_user_by_id(detail['new_value'])
-                        new = new_user.firstname+" "+new_user.lastname
+                        new = lookup_user_name(detail['new_value'])
                     else:
                         new = "Unassigned"
                 else:
@@ -1279,22 +2092,18 @@ def issue_journal_details(issue):
         cnt += 1
     return response
 
-def top5_detail(issue, rank, cnt=None):
-    tag = issue_tag(issue.created_on, issue.updated_on)
-    username = issue_top5_user(issue)
-    watchers = issue_watchers(issue)
+def top5_detail(issue, rank, cnt=None, hours=None, watchers=None):
+    fragments = issue_fragments(issue)
+    tag = issue_tag(fragments['created'], fragments['updated'])
+    watchers = issue_watchers(issue, None if watchers is None else watchers.get(issue.id, []))
 
     rank_out = issue_rank_tag(rank)
     if cnt:
         rank_out += "."+str(cnt)
-    rank_out += " "
 
-    response = "> "+tag+" "+rank_out+" "+issue_status(issue)+" "+ \
-               issue_subject_url(issue.id, issue.subject)+" "+ \
-               issue_time_percent_details(issue) + username + watchers
-
-    response += "\n"
-    return response
+    return "".join(["> ", tag, " ", rank_out, "  ", fragments['status'], " ", \
+                    fragments['subject'], " ", issue_time_percent_details(issue, hours), \
+                    fragments['top5_user'], watchers, "\n"])
 
 def issue_comment(text):
     comment = ""
@@ -1311,16 +2120,18 @@ def issue_comment(text):
 def issue_project(project):
     return "`"+project.name+" ("+project.identifier+")`"
 
-def issue_watchers(issue):
-    watchers = ""
-    for watcher in issue.watchers:
-        if len(watchers) > 0:
-            watchers += ", "
-        watchers += watcher.name
-    if watchers is "":
-        return ""
+def issue_watchers(issue, watchers=None):
+    """
+        `watchers` is an optional list of raw watchers prefetched with
+        rm_get_watchers; without it the issue loads its own
+    """
+    if watchers is None:
+        names = [watcher.name for watcher in issue.watchers]
     else:
-        return " :eyes: _"+watchers+"_"
+        names = [watcher['name'] for watcher in watchers]
+    if not names:
+        return ""
+    return " :eyes: _"+", ".join(names)+"_"
 
 """
     Time conversion helper functions
@@ -1330,11 +2141,112 @@ def utc2local(utc):
     offset = datetime.fromtimestamp (epoch) - datetime.utcfromtimestamp (epoch)
     return utc + offset
 
+# Local timezone offset, worked out once per day rather than per issue
+LOCAL_OFFSET = {'day': None, 'offset': None}
+
+def local_offset():
+    """
+        UTC offset of the local timezone today; close enough to bucket
+        issues by day, utc2local stays exact for printed timestamps
+    """
+    today = datetime.today().date()
+    if LOCAL_OFFSET['day'] != today:
+        epoch = time.time()
+        LOCAL_OFFSET['offset'] = datetime.fromtimestamp(epoch) - datetime.utcfromtimestamp(epoch)
+        LOCAL_OFFSET['day'] = today
+    return LOCAL_OFFSET['offset']
+
 def local2utc(local):
     epoch = time.mktime(local.timetuple())
     offset = datetime.fromtimestamp (epoch) - datetime.utcfromtimestamp (epoch)
     return local - offset
 
+"""
+    RTM helper functions
+"""
+# Throughput of the RTM loop: batches with commands and commands handled
+RTM_STATS = {'batches': 0, 'commands': 0, 'max_per_batch': 0, 'last_read': None}
+READ_WEBSOCKET_DELAY = 1 # 1 second delay between reading from firehose
+# event mode: back off 10ms..250ms only when woken without any events
+RTM_IDLE_MIN = 0.01
+RTM_IDLE_MAX = 0.25
+
+def wait_for_rtm(timeout):
+    """
+        Block until the RTM websocket has data to read or `timeout` seconds
+        pass; returns True when woken by incoming data
+    """
+    try:
+        sock = sc.server.websocket.sock
+        # TLS may already hold decrypted bytes that select cannot see
+        if hasattr(sock, 'pending') and sock.pending():
+            return True
+        readable, _, _ = select.select([sock], [], [], timeout)
+        return len(readable) > 0
+    except (AttributeError, ValueError, select.error):
+        # no live socket (e.g. reconnecting); behave like the fixed poll
+        time.sleep(timeout)
+        return False
+
+def rtm_loop(running=None):
+    """
+        Read the RTM firehose and dispatch the commands in each batch until
+        `running` returns False (forever when it is None)
+    """
+    idle = 0
+    while running is None or running():
+        events = sc.rtm_read()
+        RTM_STATS['last_read'] = time.time()
+        handled = 0
+        for command, channel, user, ts in parse_slack_output(events):
+            if command and channel and user != BOT_ID:
+                dispatch_command(command, channel, user, ts)
+                handled += 1
+            elif channel and user != BOT_ID:
+                dispatch_command("help", channel, user, ts)
+                handled += 1
+        if handled:
+            RTM_STATS['batches'] += 1
+            RTM_STATS['commands'] += handled
+            RTM_STATS['max_per_batch'] = max(RTM_STATS['max_per_batch'], handled)
+            debug("handled "+str(handled)+" commands from a batch of " \
+                  +str(len(events))+" events")
+        if RTM_READ_MODE != 'event':
+            time.sleep(READ_WEBSOCKET_DELAY)
+        elif events:
+            idle = 0
+        else:
+            # back off before waiting, so data that wakes the wait is read
+            # right away; idle only grows while wakes bring no events
+            # (pings, partial frames)
+            time.sleep(idle)
+            if wait_for_rtm(RTM_READ_TIMEOUT):
+                idle = min(max(idle * 2, RTM_IDLE_MIN), RTM_IDLE_MAX)
+            else:
+                idle = 0
+
+def command_cost(command):
+    """
+        Scheduling class of a command: cheap, normal or expensive
+    """
+    return COMMAND_COSTS.get(command_operator(command), 'normal')
+
+def command_operator(command):
+    """
+        Verb of a command for labelling metrics; issue links are `link`
+        and anything unrecognised is `unknown`
+    """
+    operator = command.split(' ')[0].lower()
+    if operator in COMMAND_OPERATORS:
+        return operator
+    if operator.isdigit():
+        return 'link'
+    return 'unknown'
+
+def debug(msg):
+    if BOT_DEBUG:
+        sys.stderr.write("[debug] "+msg+"\n")
+
 """
     Keyword/text parsing functions
 """
@@ -1343,21 +2255,34 @@ def parse_usernames(msg):
         Parse message finding Slack user IDs and replacing them with names
     """
     users = re.finditer(SLACK_USER_RE, msg)
-    slack_users = sc.api_call("users.list")
 
     for user in users:
         userid = user.group(1)
-        username = lookup_slack_username(slack_users, userid)
+        username = lookup_slack_username(userid)
         msg = msg.replace("<@"+userid+">", "@"+username)
 
     return msg
 
-def lookup_slack_username(slack_users, userid):
-    for user in slack_users['members']:
-        if userid == user['id']:
-            return user['name']
+def lookup_slack_username(userid):
+    profile = lookup_slack_user(userid)
+    if profile:
+        return profile['user']['name']
     return "UNKNOWN"
 
+def lookup_slack_user(userid):
+    """
+        Return the `users.info` style record for a Slack user ID from the
+        workspace directory, asking Slack only for members not yet indexed
+    """
+    user = SLACK_DIRECTORY.get(userid)
+    if user:
+        return {'ok': True, 'user': user}
+    profile = sc.api_call("users.info", user=userid)
+    if profile.get('ok'):
+        SLACK_DIRECTORY.update(profile['user'])
+        return profile
+    return None
+
 def parse_keywords(msg):
     """
         Parse message finding keywords starting with '!', '$' followed by a number
@@ -1459,6 +2384,12 @@ def parse_rank(rank):
 """
     Helper functions
 """
+def issue_ids(result_sets):
+    """
+        Flatten a list of issue result sets into the IDs they contain
+    """
+    return [issue.id for result in result_sets for issue in result]
+
 def check_key_exists(target, key):
     return [tup for tup in target if tup[0] == key]
 
@@ -1469,15 +2400,25 @@ def priority_to_rank(priority):
     Main
 """
 if __name__ == "__main__":
-    READ_WEBSOCKET_DELAY = 1 # 1 second delay between reading from firehose
     if sc.rtm_connect():
         print("RedmineBot connected and running!")
-        while True:
-            command, channel, user, username = parse_slack_output(sc.rtm_read())
-            if command and channel and user != BOT_ID and username:
-                handle_command(command, channel, user, username)
-            elif channel and user != BOT_ID:
-                handle_command("help", channel, user,  username)
-            time.sleep(READ_WEBSOCKET_DELAY)
+        if EXECUTOR is not None:
+            EXECUTOR.start()
+        try:
+            print("Loaded "+str(SLACK_DIRECTORY.load(sc))+" Slack users")
+        except:
+            traceback.print_exc(file=sys.stderr)
+        print("Loaded Redmine catalog: "+", ".join(CATALOG.load()))
+        if not CATALOG.name('queries', REDMINE_WATCHED_QUERY_ID):
+            print("Watched issues query "+str(REDMINE_WATCHED_QUERY_ID)+" not found in Redmine")
+        if CATALOG_REFRESH > 0:
+            CATALOG.start_refresh(CATALOG_REFRESH)
+        if MIRROR is not None:
+            MIRROR.start_sync(MIRROR_SYNC_INTERVAL, MIRROR_RESYNC_INTERVAL)
+            print("Syncing Redmine mirror to "+REDMINE_MIRROR_PATH)
+        if METRICS_PORT > 0:
+            start_metrics_server(METRICS, METRICS_PORT, METRICS_ADDRESS)
+            print("Serving metrics on port "+str(METRICS_PORT))
+        rtm_loop()
     else:
         print("Connection failed. Invalid Slack token or bot ID?")
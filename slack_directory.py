@@ -0,0 +1,59 @@
+import threading
+
+"""
+    Slack workspace directory
+"""
+USERS_PAGE_SIZE = 200
+
+def load_slack_users(slack_client, limit=USERS_PAGE_SIZE):
+    """
+        Retrieve every member of the workspace using cursor pagination
+        so large workspaces are fetched in pages rather than one response
+    """
+    members = []
+    cursor = None
+    while True:
+        params = dict(limit=limit)
+        if cursor:
+            params['cursor'] = cursor
+        api_call = slack_client.api_call("users.list", **params)
+        if not api_call.get('ok'):
+            raise RuntimeError(":x: Failed to list Slack users: " \
+                               +str(api_call.get('error')))
+        members.extend(api_call.get('members', []))
+        cursor = api_call.get('response_metadata', {}).get('next_cursor')
+        if not cursor:
+            return members
+
+class SlackDirectory(object):
+    """
+        In-memory index of Slack workspace members by user ID
+
+        Filled once with `load` and kept current by passing RTM
+        `team_join`/`user_change` events to `handle_event`
+    """
+    def __init__(self):
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def load(self, slack_client):
+        users = dict((u['id'], u) for u in load_slack_users(slack_client))
+        with self._lock:
+            self._users = users
+        return len(users)
+
+    def update(self, user):
+        with self._lock:
+            self._users[user['id']] = user
+
+    def handle_event(self, event):
+        if event.get('type') in ('team_join', 'user_change') and 'user' in event:
+            self.update(event['user'])
+            return True
+        return False
+
+    def get(self, userid):
+        return self._users.get(userid)
+
+    def __len__(self):
+        return len(self._users)
@@ -0,0 +1,144 @@
+import itertools
+import json
+import sys
+import threading
+import time
+
+"""
+    Per-command trace spans
+"""
+class Span(object):
+    """
+        Timed operation within a trace; used as a context manager, it
+        becomes the parent of spans opened inside it on the same thread
+    """
+    def __init__(self, tracer, name, attrs, parent=None):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.root = parent.root if parent is not None else self
+        self.id = next(tracer.ids)
+        self.start = None
+        self.end = None
+        if parent is None:
+            self.spans = []
+            self.dropped = 0
+        self.root.spans.append(self)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def duration_ms(self):
+        return ((self.end or time.time()) - self.start) * 1000
+
+    def __enter__(self):
+        self.start = time.time()
+        self.tracer.push(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.time()
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.tracer.pop(self)
+        if self.parent is None:
+            self.tracer.finish(self)
+        return False
+
+class NullSpan(object):
+    """
+        Stand-in returned when nothing is being traced
+    """
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Tracer(object):
+    """
+        Collects a tree of spans for each traced command and writes it as
+        JSON lines, one per span, when the command took at least
+        `slow_ms`; a `slow_ms` of None turns tracing off entirely
+
+        Spans past `max_spans` in one trace are counted but not kept so a
+        runaway command cannot grow a trace without bound.
+    """
+    def __init__(self, slow_ms=None, stream=None, max_spans=1000):
+        self.slow_ms = slow_ms
+        self.stream = stream or sys.stderr
+        self.max_spans = max_spans
+        self.ids = itertools.count(1)
+        self.traced = 0
+        self.logged = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def enabled(self):
+        return self.slow_ms is not None
+
+    def current(self):
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else None
+
+    def trace(self, name, **attrs):
+        """
+            Root span of a new trace
+        """
+        if self.slow_ms is None:
+            return NULL_SPAN
+        return Span(self, name, attrs)
+
+    def span(self, name, **attrs):
+        """
+            Child of the current span; a no-op outside a trace
+        """
+        parent = self.current()
+        if parent is None:
+            return NULL_SPAN
+        if len(parent.root.spans) >= self.max_spans:
+            parent.root.dropped += 1
+            return NULL_SPAN
+        return Span(self, name, attrs, parent)
+
+    def push(self, span):
+        if getattr(self._local, 'stack', None) is None:
+            self._local.stack = []
+        self._local.stack.append(span)
+
+    def pop(self, span):
+        stack = self._local.stack
+        if stack and stack[-1] is span:
+            stack.pop()
+
+    def finish(self, root):
+        self.traced += 1
+        if root.duration_ms() < self.slow_ms:
+            return
+        lines = []
+        for span in root.spans:
+            if span.start is None:
+                continue
+            record = dict(span.attrs)
+            record.update({
+                'trace': root.id,
+                'span': span.id,
+                'parent': span.parent.id if span.parent is not None else None,
+                'name': span.name,
+                'start': round(span.start, 6),
+                'ms': round(span.duration_ms(), 3)
+            })
+            if span is root:
+                record['spans'] = len(root.spans)
+                record['dropped'] = root.dropped
+            lines.append(json.dumps(record, sort_keys=True, default=str))
+        with self._lock:
+            self.stream.write("\n".join(lines)+"\n")
+            self.stream.flush()
+            self.logged += 1